@@ -3,19 +3,134 @@ Created on 19 ott 2019
 
 @author: Matteo
 '''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from kivy.app import App
+from kivy.event import EventDispatcher
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
 from kivy.lang import Builder
 from kivy.logger import Logger
+from kivy.metrics import dp
 from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.datamodel import RecycleDataModelBehavior
 from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.gridlayout import GridLayout
 from kivy.properties import BooleanProperty, NumericProperty, ObjectProperty, StringProperty
 from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.behaviors import FocusBehavior
 from kivy.uix.recycleview.layout import LayoutSelectionBehavior
-import socket
+from devicedl.render import thumbnail
+from devicedl.rows import RowStore
+
+
+class IconTextures(object):
+    """
+    LRU of the textures of the row icons, keyed by icon path: recycled rows
+    showing an icon already seen reuse its texture.
+    Missing textures are decoded by load in worker threads, scaled down to
+    size pixels; the texture is made in the UI thread. When variants (an
+    IconVariants) is set, the scaled copy of the icon is read instead.
+    """
+
+    def __init__(self, maxsize=256, size=None):
+        self.maxsize = maxsize
+        self.size = size or int(dp(56))
+        self._textures = OrderedDict()
+        self._loading = dict()
+        self._executor = ThreadPoolExecutor(2)
+        self._placeholder = None
+        self.variants = None
+
+    @property
+    def placeholder(self):
+        if self._placeholder is None:
+            self._placeholder = Texture.create(size=(1, 1), colorfmt='rgba')
+            self._placeholder.blit_buffer(bytes(4), colorfmt='rgba', bufferfmt='ubyte')
+        return self._placeholder
+
+    def get(self, path):
+        tex = self._textures.get(path)
+        if tex is not None:
+            self._textures.move_to_end(path)
+        return tex
+
+    def load(self, path, callback):
+        """
+        Load the texture of path: callback(path, texture) is called in the
+        UI thread when it is ready (texture is None if path cannot be
+        loaded).
+        """
+        entry = self._loading.get(path)
+        if entry is None:
+            fut = self._executor.submit(self._decode, path)
+            entry = self._loading[path] = (fut, [])
+            fut.add_done_callback(lambda f: Clock.schedule_once(lambda dt: self._loaded(path, f)))
+        entry[1].append(callback)
+
+    def _decode(self, path):
+        if self.variants:
+            path = self.variants.get(path, self.size)
+        return thumbnail(path, self.size)
+
+    def cancel(self, path, callback):
+        entry = self._loading.get(path)
+        if entry and callback in entry[1]:
+            entry[1].remove(callback)
+            if not entry[1] and entry[0].cancel():
+                del self._loading[path]
+
+    def _loaded(self, path, fut):
+        entry = self._loading.get(path)
+        if entry is None or entry[0] is not fut:
+            return
+        del self._loading[path]
+        tex = None
+        try:
+            width, height, data = fut.result()
+            tex = Texture.create(size=(width, height), colorfmt='rgba')
+            tex.blit_buffer(data, colorfmt='rgba', bufferfmt='ubyte')
+            tex.flip_vertical()
+            self._textures[path] = tex
+            if len(self._textures) > self.maxsize:
+                self._textures.popitem(last=False)
+        except Exception as ex:
+            Logger.warning(f'IconTextures: cannot load {path}: {ex!r}')
+        for callback in entry[1]:
+            callback(path, tex)
+
+    def clear(self):
+        self._textures.clear()
+
+
+icon_textures = IconTextures()
+
+
+class VirtualDataModel(RecycleDataModelBehavior, EventDispatcher):
+    """
+    Data model keeping the rows in a RowStore: the RecycleView builds the
+    row dicts only for the views it shows. A list of row dicts assigned to
+    data is stored in a new RowStore.
+    """
+    data = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super(VirtualDataModel, self).__init__(**kwargs)
+        self.data = RowStore()
+
+    def on_data(self, inst, value):
+        if not isinstance(value, RowStore):
+            self.data = RowStore(value or ())
+        else:
+            self.dispatch('on_data_changed')
+
+    def extend(self, rows):
+        n = len(self.data)
+        self.data.extend(rows)
+        if len(self.data) > n:
+            self.dispatch('on_data_changed', appended=slice(n, len(self.data)))
 
 
 class SelectableRecycleBoxLayout(FocusBehavior, LayoutSelectionBehavior,
@@ -36,7 +151,7 @@ Builder.load_string('''
         id: id_selected
     Image:
         id: id_icon
-        source: root.ico
+        texture: root.ico_texture
     Button:
         id: id_shname
         text: root.shname
@@ -62,14 +177,12 @@ class SelectableLabel(RecycleDataViewBehavior, GridLayout):
     selectable = BooleanProperty(True)
     shname = StringProperty()
     ico = StringProperty()
+    ico_texture = ObjectProperty(None, allownone=True)
     unbind_f = ObjectProperty(None, allownone=True)
     cols = 3
 
     def send_sh(self):
-        datahere = self.parent.parent.data[self.index]
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-        Logger.info("udp://" + datahere['host'] + ':' + str(datahere['udpport']) + '/' + datahere['msg'])
-        sock.sendto(bytes(datahere['msg'], "utf-8"), (datahere['host'], datahere['udpport']))
+        App.get_running_app().send_command(self.parent.parent.data[self.index])
 
     def on_check_active(self, obj, active, rv=None):
         self.selected = active
@@ -81,8 +194,9 @@ class SelectableLabel(RecycleDataViewBehavior, GridLayout):
             self.ids.id_selected.unbind(active=self.unbind_f)
         self.unbind_f = partial(self.on_check_active, rv=rv)
         self.index = index
-        self.shname = data['name']
-        self.ico = data['ico']
+        self.shname = data['group'] + ': ' + data['name'] if data.get('group') else data['name']
+        if self.ico != data['ico']:
+            self.set_icon(data['ico'])
         self.selected = data['sel']
         self.ids.id_selected.active = data['sel']
         # self.apply_selection(rv, index, self.selected)
@@ -90,6 +204,20 @@ class SelectableLabel(RecycleDataViewBehavior, GridLayout):
         return super(SelectableLabel, self).refresh_view_attrs(
             rv, index, data)
 
+    def set_icon(self, path):
+        if self.ico:
+            # The row was recycled: its old icon is not needed any more
+            icon_textures.cancel(self.ico, self.on_icon_loaded)
+        self.ico = path
+        tex = icon_textures.get(path)
+        if tex is None and path:
+            icon_textures.load(path, self.on_icon_loaded)
+        self.ico_texture = tex or icon_textures.placeholder
+
+    def on_icon_loaded(self, path, tex):
+        if path == self.ico:
+            self.ico_texture = tex or icon_textures.placeholder
+
     def on_touch_down(self, touch):
         ''' Add selection on touch down '''
         if super(SelectableLabel, self).on_touch_down(touch):
@@ -106,7 +234,12 @@ class SelectableLabel(RecycleDataViewBehavior, GridLayout):
 
 
 class RV(RecycleView):
-    pass
+    def __init__(self, **kwargs):
+        kwargs.setdefault('data_model', VirtualDataModel())
+        super(RV, self).__init__(**kwargs)
+
+    def extend(self, rows):
+        self.data_model.extend(rows)
 
 
 class TestApp(App):
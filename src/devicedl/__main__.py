@@ -0,0 +1,7 @@
+import sys
+
+from .cli import main
+
+# Guarded: icon render processes import this module again
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import asyncio
+import fnmatch
+import re
+from sys import intern
+
+_GLOB_MAGIC = re.compile(r'[*?[]')
+
+
+class Device(object):
+    """
+    Compact record of a hub device.
+    sh is the tuple of the names of the device shortcuts, remotes maps the
+    name of every remote to the tuple of its key names: both are None
+    when the hub does not give them.
+    hub and fullname are set when the device is added to a DeviceCatalog.
+    """
+    __slots__ = ('name', 'type', 'subtype', 'nicks', 'sh', 'remotes', 'hub', 'fullname')
+
+    def __init__(self, name, type, subtype=None, nicks=None, sh=None, remotes=None):
+        self.name = name
+        self.type = type
+        self.subtype = subtype
+        self.nicks = nicks
+        self.sh = sh
+        self.remotes = remotes
+        self.hub = None
+        self.fullname = name
+
+    def __repr__(self):
+        return f'Device({self.fullname}, {self.type})'
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Build the record from a device of the hub answer: only the names
+        of shortcuts and keys are kept (without duplicates).
+        """
+        sh = None
+        if 'sh' in d:
+            sh = tuple(dict.fromkeys(intern(k.split(':')[0]) for k in d['sh']))
+        remotes = None
+        if 'dir' in d:
+            remotes = dict()
+            for k in d['dir']:
+                parts = k.split(':')
+                remotes.setdefault(intern(parts[0]), dict())[intern(parts[1])] = None
+            remotes = {remn: tuple(keys) for remn, keys in remotes.items()}
+        subtype = d.get('subtype')
+        return cls(d['name'], d['type'],
+                   subtype=int(subtype) if subtype is not None else None,
+                   nicks=d.get('nicks'),
+                   sh=sh,
+                   remotes=remotes)
+
+
+class DeviceCatalog(object):
+    """
+    Devices of one or more hubs, indexed by full name and by
+    (full name, remote). The full name of a device is its name,
+    prefixed by "<hub name>:" when there is more than one hub.
+    The remote of the shortcuts of a device is "sh".
+    """
+
+    def __init__(self, hubs, devlists):
+        self.devices = []
+        self.by_name = dict()
+        self.by_remote = dict()
+        self.filters = []
+        multi = len(hubs) > 1
+        for hub, devs in zip(hubs, devlists):
+            for dev in devs:
+                dev.hub = hub
+                dev.fullname = f'{hub.name}:{dev.name}' if multi else dev.name
+                self._add(dev)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def _add(self, dev):
+        fn = dev.fullname
+        self.devices.append(dev)
+        self.by_name[fn] = dev
+        if dev.sh is not None:
+            self.by_remote[(fn, 'sh')] = dev.sh
+            self.filters.append(fn + '/sh')
+        if dev.remotes is not None:
+            for remn, keys in dev.remotes.items():
+                self.by_remote[(fn, remn)] = keys
+                self.filters.append(fn + '/' + remn)
+        if dev.sh is None and dev.remotes is None:
+            self.filters.append(fn)
+
+    def resolve(self, patterns):
+        """
+        Resolve the filters in patterns ("device", "device/remote" or glob
+        patterns like "tv*/sh", "rm1/*") in a single pass over the catalog.
+        Return a list of (filter, device, remote) without duplicates, in
+        the order of patterns; remote is None for filters without one.
+        """
+        found = {p: [] for p in patterns}
+        globs = []
+        for p in patterns:
+            if _GLOB_MAGIC.search(p):
+                globs.append((p, re.compile(fnmatch.translate(p))))
+            else:
+                name, _, remote = p.partition('/')
+                dev = self.by_name.get(name)
+                # The remote must exist, for devices that have remotes
+                if dev and (not remote or (dev.sh is None and dev.remotes is None) or
+                            (name, remote) in self.by_remote):
+                    found[p].append((p, dev, remote or None))
+        if globs:
+            for f in self.filters:
+                for p, rx in globs:
+                    if rx.match(f):
+                        name, _, remote = f.partition('/')
+                        found[p].append((f, self.by_name[name], remote or None))
+        seen = set()
+        out = []
+        for p in patterns:
+            for item in found[p]:
+                if item[0] not in seen:
+                    seen.add(item[0])
+                    out.append(item)
+        return out
+
+
+def split_filters(s):
+    return [f.strip() for f in s.split(',') if f.strip()]
+
+
+async def fetch_devices(conn, deadline, max_size, progress=None):
+    """
+    Download the devices of the hub of the HubConnection conn as Device
+    records, in at most deadline seconds.
+    """
+    devices = []
+    await asyncio.wait_for(
+        conn.download_devices(
+            lambda name, dev: devices.append(Device.from_dict(dev)),
+            on_start=devices.clear,
+            progress=progress,
+            max_size=max_size),
+        deadline)
+    return devices
@@ -0,0 +1,146 @@
+"""
+Command line export of shortcut packs, without Kivy:
+
+    python -m devicedl --host 192.168.1.1 --icons icons --out packs "tv*" "rm1/*"
+
+downloads the device lists of the hubs, builds the shortcuts of the
+devices matching the filters (the device setting of the app), renders
+their icons and writes an export file per device in --out, or all of them
+in the --bundle file.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from os.path import join
+
+from .catalog import DeviceCatalog, fetch_devices, split_filters
+from .export import export_filename, export_shortcuts, group_shortcuts, shortcut_template
+from .hubclient import HubConnection
+from .hubs import parse_hubs
+from .iconcache import IconCache
+from .icons import IconIndex
+from .render import RENDER_VERSION, TEXT_FONT, RenderQueue
+from .rows import RowStore
+from .shortcuts import DEFAULT_COLOR, ShortcutBuilder, color_map
+from .snapshot import load_snapshot, save_snapshot, snapshot_path
+from .utils import Logger
+from .variants import EXPORT_SIZE, IconVariants
+
+
+def _parser():
+    p = argparse.ArgumentParser(prog='devicedl', description='Export the shortcuts of hub devices.')
+    p.add_argument('filters', nargs='+',
+                   help='devices to export: "device", "device/remote" or glob patterns, also comma separated')
+    p.add_argument('--host', default='192.168.1.1', help='first hub')
+    p.add_argument('--tcpport', type=int, default=10001)
+    p.add_argument('--udpport', type=int, default=10000)
+    p.add_argument('--hubs', default='', help='other hubs: [name=]host[:tcpport[:udpport]],...')
+    p.add_argument('--icons', required=True, help='icon directory (generated icons go in its "generated" subdirectory)')
+    p.add_argument('--color', default=DEFAULT_COLOR, choices=sorted(color_map()))
+    p.add_argument('--font', default=TEXT_FONT,
+                   help='TrueType font of the text icons, file or name (a fallback one is used if missing)')
+    p.add_argument('--shname', default='$p0$_$p1$_$sh$', help='shortcut description template')
+    p.add_argument('--match', default='', help='export only the shortcuts whose name matches')
+    out = p.add_mutually_exclusive_group()
+    out.add_argument('--out', default='.', help='directory of the export files, one per device')
+    out.add_argument('--bundle', help='single export file with a category per device')
+    p.add_argument('--snapshots', help='directory of the device snapshots, used when a hub is unreachable')
+    p.add_argument('--deadline', type=float, default=30, help='seconds to download the devices of a hub')
+    p.add_argument('--maxdlkb', type=int, default=32768, help='maximum size of a device list')
+    p.add_argument('--cachemb', type=int, default=20, help='budget of the generated icons')
+    p.add_argument('--workers', type=int, default=None, help='icon render processes')
+    p.add_argument('-v', '--verbose', action='store_true')
+    return p
+
+
+async def _download(hubs, args):
+    conns = [HubConnection(hub.host, hub.tcpport) for hub in hubs]
+    try:
+        return await asyncio.gather(*[fetch_devices(conn, args.deadline, args.maxdlkb * 1024)
+                                      for conn in conns], return_exceptions=True)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def download_catalog(hubs, args):
+    """
+    Return the DeviceCatalog of hubs, using the saved snapshot of the
+    hubs that cannot be reached. None if no device list is available.
+    """
+    results = asyncio.run(_download(hubs, args))
+    devlists = []
+    found = False
+    for hub, res in zip(hubs, results):
+        snpath = snapshot_path(args.snapshots, hub.host, hub.tcpport) if args.snapshots else None
+        if isinstance(res, BaseException):
+            Logger.error(f'Download from {hub} failed: {res!r}')
+            snap = load_snapshot(snpath) if snpath else None
+            if snap:
+                Logger.info(f'Using the device snapshot of {hub} of {time.ctime(snap.created)}')
+                found = True
+            devlists.append(snap.devices if snap else [])
+        else:
+            found = True
+            devlists.append(res)
+            if snpath:
+                save_snapshot(snpath, res)
+    return DeviceCatalog(hubs, devlists) if found else None
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(levelname)s %(message)s')
+    if args.snapshots:
+        os.makedirs(args.snapshots, exist_ok=True)
+    hubs = parse_hubs(args.host, args.tcpport, args.udpport, args.hubs)
+    catalog = download_catalog(hubs, args)
+    if catalog is None:
+        return 2
+    groups = catalog.resolve(split_filters(','.join(args.filters)))
+    if not groups:
+        Logger.error('No device matches ' + ', '.join(args.filters))
+        return 1
+
+    icon_index = IconIndex(args.icons)
+    icon_cache = IconCache(RENDER_VERSION, args.cachemb * 1024 * 1024)
+    icon_cache.set_path(icon_index.generated)
+    render_queue = RenderQueue(args.workers, on_written=icon_cache.add)
+    rendered = set()
+    builder = ShortcutBuilder(icon_index, icon_cache, render_queue, color=args.color, on_icons=rendered.update,
+                              font=args.font)
+    rows = RowStore()
+    try:
+        shs = []
+        for group, dev, remote in groups:
+            builder.device_shortcuts(shs, dev, remote, group if len(groups) > 1 else '')
+        rows.extend(shs)
+        render_queue.wait()
+    finally:
+        render_queue.shutdown()
+    # Icons that failed keep the default one
+    rows.resolve_pending(rendered)
+    if args.match:
+        rows.set_filter(rows.search(args.match))
+
+    variants = IconVariants(icon_cache)
+    exported = 0
+    for device, (shs, _, _) in group_shortcuts(rows).items():
+        imgs = variants.get_all([sh['img'] for sh in shs], EXPORT_SIZE)
+        for sh, img in zip(shs, imgs):
+            sh['img'] = img
+        if args.bundle:
+            path = args.bundle
+        else:
+            os.makedirs(args.out, exist_ok=True)
+            path = join(args.out, export_filename(device))
+        export_shortcuts(path, shs, shortcut_template(args.shname, device),
+                         device=device if args.bundle else None)
+        exported += len(shs)
+    icon_cache.compact(keep=set(rows.ico))
+    icon_cache.save()
+    Logger.info(f'Exported {exported} shortcuts of {len(groups)} devices')
+    return 0
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+from .utils import Logger
+
+# Seconds between two commands sent to the same hub
+COMMAND_GAP = 0.1
+# Commands waiting for a hub: more are dropped
+MAX_QUEUE = 32
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in power of 2 millisecond buckets: bucket k holds
+    the latencies below 2**k ms, the last one the longer ones.
+    """
+
+    def __init__(self, nbuckets=14):
+        self.counts = [0] * nbuckets
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        k = min(max(int(ms), 0).bit_length(), len(self.counts) - 1)
+        self.counts[k] += 1
+        self.total += 1
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """
+        Upper bound in ms of the bucket holding the p-th percentile.
+        """
+        if not self.total:
+            return 0
+        n = 0
+        for k, c in enumerate(self.counts):
+            n += c
+            if n >= self.total * p / 100:
+                return 2 ** k if k < len(self.counts) - 1 else self.max
+        return self.max
+
+    def __str__(self):
+        return f'n={self.total} p50<{self.percentile(50)}ms p95<{self.percentile(95)}ms max={self.max:.1f}ms'
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, sender):
+        self.sender = sender
+
+    def error_received(self, exc):
+        Logger.warning(f'Commands: {self.sender.addr} error {exc!r}')
+
+    def connection_lost(self, exc):
+        self.sender.transport = None
+
+
+class _HubSender(object):
+    """
+    Socket and paced queue of the commands of one hub.
+    """
+
+    def __init__(self, dispatcher, addr):
+        self.dispatcher = dispatcher
+        self.addr = addr
+        self.transport = None
+        self.queue = asyncio.Queue(dispatcher.max_queue)
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        last = 0
+        while True:
+            msg, fut, queued = await self.queue.get()
+            wait = last + self.dispatcher.gap - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                if self.transport is None:
+                    self.transport, _ = await loop.create_datagram_endpoint(
+                        lambda: _Protocol(self), remote_addr=self.addr)
+                self.transport.sendto(msg.encode('utf-8'))
+                self.dispatcher.latency.record(time.perf_counter() - queued)
+                Logger.info(f'udp://{self.addr[0]}:{self.addr[1]}/{msg}')
+                if not fut.done():
+                    fut.set_result(True)
+            except Exception as ex:
+                Logger.warning(f'Commands: cannot send {msg} to {self.addr}: {ex!r}')
+                if not fut.done():
+                    fut.set_exception(ex)
+            last = loop.time()
+
+    def close(self):
+        self.task.cancel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+
+class CommandDispatcher(object):
+    """
+    Sends the UDP commands of the shortcuts: one socket per hub, reused,
+    and a queue per hub sending a command every gap seconds. When a queue
+    is full further commands are dropped. The time from send to the
+    write on the socket is recorded in latency.
+    Must be used from the thread of the asyncio loop.
+    """
+
+    def __init__(self, gap=COMMAND_GAP, max_queue=MAX_QUEUE):
+        self.gap = gap
+        self.max_queue = max_queue
+        self.latency = LatencyHistogram()
+        self._senders = dict()
+
+    def send(self, host, port, msg):
+        """
+        Queue msg for host:port. Return a future set when it is sent.
+        """
+        fut = asyncio.get_event_loop().create_future()
+        addr = (host, int(port))
+        sender = self._senders.get(addr)
+        if sender is None:
+            sender = self._senders[addr] = _HubSender(self, addr)
+        try:
+            sender.queue.put_nowait((msg, fut, time.perf_counter()))
+        except asyncio.QueueFull:
+            Logger.warning(f'Commands: queue of {host}:{port} is full, dropping {msg}')
+            fut.set_result(False)
+        return fut
+
+    async def send_sequence(self, commands, interval=0):
+        """
+        Send commands, a list of (host, port, msg), one after the other,
+        waiting interval seconds after each one is sent. Return the number
+        of commands sent.
+        """
+        sent = 0
+        for k, (host, port, msg) in enumerate(commands):
+            if k and interval:
+                await asyncio.sleep(interval)
+            try:
+                if await self.send(host, port, msg):
+                    sent += 1
+            except Exception:
+                pass
+        Logger.info(f'Commands: sequence {sent}/{len(commands)} sent, latency {self.latency}')
+        return sent
+
+    def close(self):
+        for sender in self._senders.values():
+            sender.close()
+        self._senders.clear()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname, exists, join
+from urllib.parse import quote, unquote
+
+from .utils import Logger
+
+IMAGES_DIR = 'outimages'
+EXPORT_VERSION = 40
+# Category of the exports of a single device
+DEFAULT_CATEGORY = dict(id="fdeb3bb8-ae8e-4660-99c5-42420d142580", name="Scorciatoie")
+# Positional tag of a command (see ShortcutBuilder.device_shortcuts)
+_TAG_RE = re.compile(r'^@[0-9]+ ')
+
+
+def shortcut_template(shname, device):
+    """
+    Label template of the shortcuts of device (a filter like
+    "device/remote") from the shname setting: $p0$ and $p1$ are replaced
+    by the parts of device, $sh$ is left for the shortcut name.
+    """
+    parts = device.split('/')
+    shtemp = shname.replace('$p0$', parts[0])
+    shtemp = shtemp.replace('$p1$', parts[1] if len(parts) > 1 else '')
+    return shtemp.replace('  ', ' ').replace('__', '_').replace(' - - ', ' - ')
+
+
+def export_filename(device):
+    return device.replace('/', ' - ').replace(':', ' - ') + ' - sh.json'
+
+
+def shortcut_link(host, udpport, msg):
+    return f'udp://{host}:{udpport}/{quote(msg)}'
+
+
+def group_shortcuts(rows):
+    """
+    Group the shortcut rows by filter (device or device/remote), as the
+    export files do. Return a dict from filter to (shs, device_info,
+    network_info), shs being the dicts with name, img and link.
+    """
+    groups = dict()
+    for sh in rows:
+        if sh['filter'] not in groups:
+            groups[sh['filter']] = (
+                [],
+                dict(name=sh['dname'], name2=sh['dname2'], type=sh['dtype']),
+                dict(host=sh['host'], tcpport=sh['tcpport'], udpport=sh['udpport']))
+        groups[sh['filter']][0].append(dict(
+            name=sh['name'],
+            img=sh['ico'],
+            link=shortcut_link(sh['host'], sh['udpport'], sh['msg'])
+        ))
+    return groups
+
+
+def shortcut_id(sh):
+    """
+    Identity of an exported shortcut: hub address and command without its
+    "@<n>" tag, that changes when keys are added to or removed from a
+    remote. The same command gets the same id at every export.
+    """
+    scheme, _, rest = sh['link'].partition('://')
+    addr, _, msg = rest.partition('/')
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{scheme}://{addr}/' + _TAG_RE.sub('', unquote(msg))))
+
+
+def _legacy_id(sh):
+    # Id of the exports made before shortcut_id dropped the tag
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, sh['link']))
+
+
+def _content_name(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            h.update(block)
+    return h.hexdigest() + os.path.splitext(path)[1]
+
+
+def _copy_image(path, outdir):
+    name = _content_name(path)
+    dest = join(outdir, name)
+    if not exists(dest):
+        tmp = f'{dest}.{os.getpid()}.tmp'
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+    return name
+
+
+def export_images(paths, outdir, workers=4):
+    """
+    Copy the images in paths to outdir, named by the hash of their content
+    (images already there are not copied again), with workers threads.
+    Return a dict from path to its name in outdir.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    unique = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(workers) as ex:
+        names = list(ex.map(lambda p: _copy_image(p, outdir), unique))
+    return dict(zip(unique, names))
+
+
+def load_export(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as ex:
+        Logger.warning(f'Export: cannot read {path}, writing a new one: {ex!r}')
+    return dict(categories=[], version=EXPORT_VERSION)
+
+
+def merge_shortcuts(outjson, category, entries, aliases=None):
+    """
+    Merge entries in the category of outjson with the id of category
+    (created if missing): entries with the id of an existing shortcut
+    (or with its old id, aliases maps ids to old ones) replace it, the
+    others are appended. Return the number of new ones.
+    """
+    aliases = aliases or dict()
+    for cat in outjson['categories']:
+        if cat['id'] == category['id']:
+            break
+    else:
+        cat = dict(category, shortcuts=[])
+        outjson['categories'].append(cat)
+    pos = {sh['id']: i for i, sh in enumerate(cat['shortcuts'])}
+    added = 0
+    for entry in entries:
+        i = pos.get(entry['id'])
+        if i is None and entry['id'] in aliases:
+            i = pos.pop(aliases[entry['id']], None)
+            if i is not None:
+                pos[entry['id']] = i
+        if i is None:
+            pos[entry['id']] = len(cat['shortcuts'])
+            cat['shortcuts'].append(entry)
+            added += 1
+        else:
+            cat['shortcuts'][i] = entry
+    return added
+
+
+def write_export(path, outjson):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as outfile:
+        outfile.write(json.dumps(outjson, indent=4))
+    os.replace(tmp, path)
+
+
+def export_shortcuts(path, shs, shtemp, device=None):
+    """
+    Add the shortcuts shs (dicts with name, img and link) to the export
+    file path, merging them with the ones already there. With device the
+    shortcuts go in a category of their own, so that one file (a bundle)
+    can hold the shortcuts of many devices.
+    Return the number of shortcuts added.
+    """
+    if not shs:
+        return 0
+    names = export_images([sh['img'] for sh in shs], join(dirname(path) or '.', IMAGES_DIR))
+    entries = [dict(
+        id=shortcut_id(sh),
+        iconName=f'{IMAGES_DIR}/{names[sh["img"]]}',
+        name=sh['name'],
+        executionType="scripting",
+        description=shtemp.replace('$sh$', sh['name']),
+        codeOnPrepare='sendIntent({"action":"android.intent.action.SENDTO","type":"activity","dataUri":"%s"});' % sh['link']
+    ) for sh in shs]
+    if device:
+        category = dict(id=str(uuid.uuid5(uuid.NAMESPACE_URL, 'device:' + device)), name=device)
+    else:
+        category = DEFAULT_CATEGORY
+    outjson = load_export(path)
+    added = merge_shortcuts(outjson, category, entries,
+                            {entry['id']: _legacy_id(sh) for entry, sh in zip(entries, shs)})
+    write_export(path, outjson)
+    Logger.info(f'Export: {path}: {added} new, {len(entries) - added} updated shortcuts')
+    return added
@@ -0,0 +1,307 @@
+import asyncio
+import random
+import re
+import socket
+import time
+from collections import OrderedDict
+
+from .jsonstream import MemberStreamParser
+from .utils import Logger
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 10.0
+IDLE_TIMEOUT = 60.0
+RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+MAX_ANSWER = 32 * 1024 * 1024
+CHUNK = 16384
+
+_TAG_RE = re.compile(rb'^@([0-9]+) ')
+_TAG_MAX = 24
+
+
+class HubError(Exception):
+    pass
+
+
+class AnswerTooLong(HubError):
+    pass
+
+
+_RETRY_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HubError)
+
+
+class _Answer(object):
+    """
+    Receiving side of a request: the answer text is either collected
+    or, when consumer is given, passed to it chunk by chunk.
+    """
+    __slots__ = ('fut', 'consumer', 'progress', 'max_size', 'size', 'chunks', 'last_rx')
+
+    def __init__(self, fut, consumer=None, progress=None, max_size=MAX_ANSWER):
+        self.fut = fut
+        self.consumer = consumer
+        self.progress = progress
+        self.max_size = max_size
+        self.size = 0
+        self.chunks = []
+        self.last_rx = time.monotonic()
+
+    def feed(self, data):
+        self.last_rx = time.monotonic()
+        if self.fut.done():
+            # Nobody waits for this answer any more: discard it
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise AnswerTooLong(f'Answer bigger than {self.max_size} bytes')
+        if self.consumer:
+            self.consumer(data)
+        else:
+            self.chunks.append(data)
+        if self.progress:
+            self.progress(self.size)
+
+    def finish(self):
+        if not self.fut.done():
+            self.fut.set_result(None if self.consumer else b''.join(self.chunks))
+
+
+class HubConnection(object):
+    """
+    Long lived connection to a devicedl hub.
+    Every request is sent as "@<tag> <command>" on the same TCP connection,
+    so several requests can be in flight together. An answer starting
+    with "@<tag> " is given to the request with that tag, any other answer
+    to the oldest pending request (the hub answers in order).
+    The connection is checked before every use, reopened when it is lost
+    and closed after IDLE_TIMEOUT seconds without requests.
+    Answers are received in CHUNK sized pieces: read_timeout is the
+    longest silence allowed while waiting for one.
+    """
+
+    def __init__(self, host, port,
+                 connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT,
+                 idle_timeout=IDLE_TIMEOUT,
+                 retries=RETRIES,
+                 backoff=BACKOFF_BASE):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._idle_handle = None
+        self._connect_lock = None
+        self._pending = OrderedDict()
+        self._current = None
+        self._head = b''
+        self._next_tag = 1
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
+
+    def is_connected(self):
+        return self._writer is not None and\
+            not self._writer.is_closing() and\
+            not self._reader.at_eof() and\
+            self._reader_task is not None and\
+            not self._reader_task.done()
+
+    async def _ensure_connected(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.is_connected():
+                return
+            self.close()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self._reader = reader
+            self._writer = writer
+            self._reader_task = asyncio.ensure_future(self._read_loop(reader))
+            Logger.info(f'HubClient: connected to {self}')
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                data = await reader.read(CHUNK)
+                if not data:
+                    raise HubError(f'Connection closed by {self}')
+                self._on_data(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            Logger.info(f'HubClient: connection to {self} lost: {ex!r}')
+            if self._reader is reader:
+                self._reader_task = None
+                self.close(ex)
+
+    def _on_data(self, data):
+        while data:
+            if self._current is None:
+                data = self._head + data
+                self._head = b''
+                if data[0:1] == b'@' and b' ' not in data[0:_TAG_MAX] and len(data) < _TAG_MAX:
+                    # Wait for the whole tag
+                    self._head = data
+                    return
+                data = self._start_answer(data)
+            idx = data.find(b'\n')
+            if idx < 0:
+                self._current.feed(data)
+                return
+            self._current.feed(data[:idx])
+            self._current.finish()
+            self._current = None
+            data = data[idx + 1:]
+
+    def _start_answer(self, data):
+        mo = _TAG_RE.match(data)
+        tag = int(mo.group(1)) if mo else None
+        if tag in self._pending:
+            data = data[mo.end():]
+        elif self._pending:
+            tag = next(iter(self._pending))
+        else:
+            Logger.debug(f'HubClient: unsolicited answer from {self}: {data[:80]}')
+            tag = None
+        if tag is None:
+            self._current = _Answer(asyncio.get_event_loop().create_future())
+            self._current.fut.cancel()
+        else:
+            self._current = self._pending.pop(tag)
+        return data
+
+    def _fail_pending(self, ex):
+        pending = list(self._pending.values())
+        if self._current:
+            pending.append(self._current)
+            self._current = None
+        self._head = b''
+        self._pending.clear()
+        for answer in pending:
+            if not answer.fut.done():
+                answer.fut.set_exception(ex)
+
+    def _arm_idle(self):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_event_loop().call_later(self.idle_timeout, self._on_idle)
+
+    def _on_idle(self):
+        self._idle_handle = None
+        if not self._pending and not self._current:
+            Logger.debug(f'HubClient: closing idle connection to {self}')
+            self.close()
+
+    def close(self, ex=None):
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._reader = None
+        self._fail_pending(ex or HubError(f'Connection to {self} closed'))
+
+    async def _request_once(self, command, **kwargs):
+        await self._ensure_connected()
+        tag = self._next_tag
+        self._next_tag += 1
+        answer = _Answer(asyncio.get_event_loop().create_future(), **kwargs)
+        self._pending[tag] = answer
+        try:
+            self._writer.write(f'@{tag} {command}\n'.encode('utf-8'))
+            await asyncio.wait_for(self._writer.drain(), self.read_timeout)
+            while True:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(answer.fut), self.read_timeout)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - answer.last_rx >= self.read_timeout:
+                        raise
+        except asyncio.TimeoutError:
+            # The answer may still come: framing is lost, start over
+            # (cancelled first: nobody would read the error close sets)
+            answer.fut.cancel()
+            self.close()
+            raise
+        except asyncio.CancelledError:
+            # Leave the answer pending: it will be received and discarded
+            answer.fut.cancel()
+            raise
+        finally:
+            self._arm_idle()
+
+    async def request(self, command, consumer=None, progress=None, max_size=MAX_ANSWER):
+        """
+        Send command to the hub and return its (newline stripped) answer.
+        If consumer is given, it is called with every received piece of the
+        answer instead and None is returned. progress is called with the
+        number of bytes received so far. Answers longer than max_size
+        bytes are an error.
+        Failed attempts are retried with exponential backoff on a new
+        connection. Cancelling the calling task aborts the request.
+        """
+        lastex = None
+        for attempt in range(self.retries):
+            await self._backoff(attempt)
+            try:
+                return await self._request_once(command, consumer=consumer, progress=progress, max_size=max_size)
+            except (asyncio.CancelledError, AnswerTooLong):
+                raise
+            except _RETRY_ERRORS as ex:
+                lastex = ex
+                self._attempt_failed(attempt, ex)
+        raise HubError(f'Cannot contact {self}: {lastex!r}') from lastex
+
+    async def _backoff(self, attempt):
+        if attempt:
+            delay = min(BACKOFF_MAX, self.backoff * (2 ** (attempt - 1)))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _attempt_failed(self, attempt, ex):
+        self.close()
+        Logger.warning(f'HubClient: attempt {attempt + 1}/{self.retries} to {self} failed: {ex!r}')
+
+    async def download_devices(self, on_device, on_start=None, progress=None, max_size=MAX_ANSWER):
+        """
+        Download the device list calling on_device(name, device) for every
+        device of action.hosts as soon as it has been received. on_start is
+        called before every attempt: devices received by a failed attempt
+        must be forgotten. Return the size of the answer.
+        """
+        lastex = None
+        for attempt in range(self.retries):
+            await self._backoff(attempt)
+            parser = MemberStreamParser(('action', 'hosts'))
+            if on_start:
+                on_start()
+
+            def consumer(data, parser=parser):
+                for name, dev in parser.feed(data):
+                    on_device(name, dev)
+            try:
+                await self._request_once('devicedl', consumer=consumer, progress=progress, max_size=max_size)
+                # A hub error answer or a truncated one is not an empty device list
+                parser.finish()
+                return parser.nbytes
+            except (asyncio.CancelledError, AnswerTooLong):
+                raise
+            except _RETRY_ERRORS + (ValueError,) as ex:
+                # ValueError: truncated, garbled or error answer
+                lastex = ex
+                self._attempt_failed(attempt, ex)
+        raise HubError(f'Cannot download devices from {self}: {lastex!r}') from lastex
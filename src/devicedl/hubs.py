@@ -0,0 +1,34 @@
+class Hub(object):
+    __slots__ = ('name', 'host', 'tcpport', 'udpport')
+
+    def __init__(self, name, host, tcpport, udpport):
+        self.name = name
+        self.host = host
+        self.tcpport = tcpport
+        self.udpport = udpport
+
+    def __str__(self):
+        return f'{self.name} ({self.host}:{self.tcpport})'
+
+
+def parse_hubs(host, tcpport, udpport, others=''):
+    """
+    Return the list of hubs to query: the one at host followed by the
+    ones in others, a comma separated list of
+    [name=]host[:tcpport[:udpport]]. Missing ports are the same of the
+    first hub.
+    """
+    hubs = [Hub(host, host, int(tcpport), int(udpport))]
+    for h in others.split(','):
+        h = h.strip()
+        if not h:
+            continue
+        name, _, addr = h.rpartition('=')
+        parts = addr.strip().split(':')
+        hub = Hub(name.strip() or parts[0],
+                  parts[0],
+                  int(parts[1]) if len(parts) > 1 and parts[1] else int(tcpport),
+                  int(parts[2]) if len(parts) > 2 and parts[2] else int(udpport))
+        if all(hub.host != o.host or hub.tcpport != o.tcpport for o in hubs):
+            hubs.append(hub)
+    return hubs
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from os.path import join
+
+from .utils import Logger
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+DEFAULT_BUDGET = 20 * 1024 * 1024
+# Files not in the manifest are deleted only when older than this many
+# seconds: younger ones may be written right now
+ORPHAN_AGE = 60
+# Temporary files of a render or scaling that did not finish
+TMP_AGE = 3600
+
+
+class IconCache(object):
+    """
+    Content addressed store of the generated icons: the file name of an icon
+    is a hash of its source content, color, text and of the renderer
+    version, so a changed source gives a new icon. manifest.json records
+    size and last use of every icon and the digests of the sources; compact
+    removes unknown files and evicts the least recently used icons above
+    budget bytes.
+    Methods can be called from the render pool threads.
+    """
+
+    def __init__(self, version, budget=DEFAULT_BUDGET):
+        self.version = version
+        self.budget = budget
+        self.path = None
+        self.entries = dict()
+        self.sources = dict()
+        self.size = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def set_path(self, path):
+        with self._lock:
+            if path == self.path:
+                return
+            if self.path:
+                self.save()
+            self.path = path
+            self.entries = dict()
+            self.sources = dict()
+            self._dirty = False
+            try:
+                os.makedirs(path, exist_ok=True)
+                with open(join(path, MANIFEST), 'r') as f:
+                    m = json.load(f)
+                if m.get('version') == MANIFEST_VERSION and m.get('renderer') == self.version:
+                    self.entries = m['entries']
+                    self.sources = m['sources']
+                else:
+                    Logger.info(f'IconCache: renderer changed, dropping {path}')
+            except FileNotFoundError:
+                pass
+            except Exception as ex:
+                Logger.warning(f'IconCache: cannot load manifest in {path}: {ex!r}')
+            self.size = sum(e[0] for e in self.entries.values())
+
+    def source_digest(self, src):
+        """
+        sha1 of the content of src: src is stat'ed at every call (a file
+        overwritten in place does not change its directory), the content
+        is read again only when its size or mtime change.
+        """
+        try:
+            st = os.stat(src)
+        except OSError:
+            return ''
+        with self._lock:
+            old = self.sources.get(src)
+            if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                return old[2]
+        with open(src, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        with self._lock:
+            self.sources[src] = [st.st_mtime_ns, st.st_size, digest]
+            self._dirty = True
+        return digest
+
+    def key(self, src, color, text='', font=''):
+        h = hashlib.sha1(f'{self.version}\0{color!r}\0{text}\0'.encode('utf8'))
+        if font:
+            h.update(f'{font}\0'.encode('utf8'))
+        if src:
+            h.update(self.source_digest(src).encode('ascii'))
+        return h.hexdigest()
+
+    def icon(self, key):
+        return join(self.path, key + '.png')
+
+    def has(self, key):
+        """
+        Return whether the icon is in the cache, marking it as used.
+        """
+        with self._lock:
+            e = self.entries.get(key)
+            if e:
+                e[1] = time.time()
+                self._dirty = True
+            return e is not None
+
+    def add(self, fom):
+        name = os.path.basename(fom)
+        try:
+            size = os.stat(fom).st_size
+        except OSError:
+            return
+        with self._lock:
+            old = self.entries.get(name[:-4])
+            self.size += size - (old[0] if old else 0)
+            self.entries[name[:-4]] = [size, time.time()]
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            m = dict(version=MANIFEST_VERSION, renderer=self.version,
+                     entries=self.entries, sources=self.sources)
+            tmp = join(self.path, MANIFEST + '.tmp')
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(m, f)
+                os.replace(tmp, join(self.path, MANIFEST))
+                self._dirty = False
+            except OSError as ex:
+                Logger.warning(f'IconCache: cannot save manifest: {ex!r}')
+
+    def compact(self, keep=(), busy=()):
+        """
+        Delete the files not in the manifest (except busy ones, being
+        rendered, and recent ones, see ORPHAN_AGE and TMP_AGE), forget
+        icons whose file is gone and evict the least recently used icons
+        until the cache fits its budget. Icons in keep (paths) are not
+        evicted. Return the number of deleted files.
+        """
+        if not self.path:
+            return 0
+        removed = 0
+        with self._lock:
+            try:
+                with os.scandir(self.path) as it:
+                    files = {e.name: e for e in it if e.is_file()}
+            except OSError:
+                return 0
+            now = time.time()
+            for name, e in files.items():
+                tmp = name.endswith('.tmp')
+                if name == MANIFEST or (not tmp and name[:-4] in self.entries) \
+                        or join(self.path, name) in busy:
+                    continue
+                try:
+                    if e.stat().st_mtime < now - (TMP_AGE if tmp else ORPHAN_AGE):
+                        removed += self._unlink(name)
+                except OSError:
+                    pass
+            for key in [k for k in self.entries if k + '.png' not in files]:
+                del self.entries[key]
+                self._dirty = True
+            self.size = sum(e[0] for e in self.entries.values())
+            if self.size > self.budget:
+                for key, e in sorted(self.entries.items(), key=lambda kv: kv[1][1]):
+                    if self.size <= self.budget:
+                        break
+                    if self.icon(key) not in keep and self._unlink(key + '.png'):
+                        del self.entries[key]
+                        self.size -= e[0]
+                        removed += 1
+                self._dirty = True
+            live = {src for src in self.sources if os.path.exists(src)}
+            if len(live) != len(self.sources):
+                self.sources = {src: v for src, v in self.sources.items() if src in live}
+                self._dirty = True
+            self.save()
+        if removed:
+            Logger.info(f'IconCache: removed {removed} files, {self.size // 1024} KB in {self.path}')
+        return removed
+
+    def _unlink(self, name):
+        try:
+            os.remove(join(self.path, name))
+            return 1
+        except OSError:
+            return 0
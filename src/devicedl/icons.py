@@ -0,0 +1,56 @@
+import os
+from os.path import join
+
+from .utils import Logger
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class IconIndex(object):
+    """
+    In memory index of the files in the icon directory, so that resolving
+    an icon name needs no system call. refresh re-reads the directory only
+    when its mtime changed. Generated icons are in its "generated"
+    subdirectory, managed by an IconCache.
+    """
+
+    def __init__(self, path=None):
+        self.path = None
+        self.generated = None
+        self._icons = frozenset()
+        self._mtime = None
+        if path:
+            self.set_path(path)
+
+    def set_path(self, path):
+        if path != self.path:
+            self.path = path
+            self.generated = join(path, 'generated')
+            self._mtime = None
+            self.refresh()
+
+    def refresh(self):
+        mtime = _mtime(self.path)
+        if mtime != self._mtime:
+            self._icons = frozenset(self._scan(self.path))
+            Logger.debug(f'IconIndex: {len(self._icons)} icons in {self.path}')
+        self._mtime = mtime
+
+    @staticmethod
+    def _scan(path):
+        try:
+            with os.scandir(path) as it:
+                return [e.name for e in it if e.name.endswith('.png') and e.is_file()]
+        except OSError:
+            return []
+
+    def has(self, name):
+        return name in self._icons
+
+    def icon(self, name):
+        return join(self.path, name)
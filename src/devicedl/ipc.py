@@ -0,0 +1,328 @@
+import base64
+import os
+import random
+import re
+import struct
+import threading
+import time
+from os.path import basename, dirname, join, realpath
+
+from .utils import Logger
+
+CODEC_VERSION = 1
+# Payload bytes in a chunk: far from the datagram limit once framed
+CHUNK_SIZE = 8192
+# Bigger payloads are written to a spool file and only its path is sent
+SPOOL_MIN = 512 * 1024
+# Name of the spool file of a message: ipc_<pid of the sender>_<msg_id>.bin
+_SPOOL_NAME_RE = re.compile(r'^ipc_[0-9]+_([0-9]+)\.bin$')
+ACK_TIMEOUT = 1.0
+RETRIES = 3
+# Incomplete messages are dropped after this many seconds
+REASSEMBLY_TIMEOUT = 30.0
+
+_DOUBLE = struct.Struct('<d')
+
+
+def _put_varint(n, out):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos):
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _encode(obj, out, strings):
+    if obj is None:
+        out += b'N'
+    elif obj is True:
+        out += b'T'
+    elif obj is False:
+        out += b'F'
+    elif isinstance(obj, int):
+        out += b'i'
+        _put_varint(obj * 2 if obj >= 0 else -obj * 2 - 1, out)
+    elif isinstance(obj, float):
+        out += b'd'
+        out += _DOUBLE.pack(obj)
+    elif isinstance(obj, str):
+        idx = strings.get(obj)
+        if idx is not None:
+            out += b'r'
+            _put_varint(idx, out)
+        else:
+            strings[obj] = len(strings)
+            b = obj.encode('utf-8')
+            out += b's'
+            _put_varint(len(b), out)
+            out += b
+    elif isinstance(obj, (bytes, bytearray)):
+        out += b'b'
+        _put_varint(len(obj), out)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        out += b'l'
+        _put_varint(len(obj), out)
+        for item in obj:
+            _encode(item, out, strings)
+    elif isinstance(obj, dict):
+        out += b'm'
+        _put_varint(len(obj), out)
+        for k, v in obj.items():
+            _encode(k, out, strings)
+            _encode(v, out, strings)
+    else:
+        raise TypeError(f'Cannot encode {type(obj).__name__}')
+
+
+def _decode(data, pos, strings):
+    tag = data[pos]
+    pos += 1
+    if tag == 0x4e:  # N
+        return None, pos
+    elif tag == 0x54:  # T
+        return True, pos
+    elif tag == 0x46:  # F
+        return False, pos
+    elif tag == 0x69:  # i
+        z, pos = _get_varint(data, pos)
+        return (z >> 1) if not z & 1 else -((z + 1) >> 1), pos
+    elif tag == 0x64:  # d
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    elif tag == 0x73:  # s
+        n, pos = _get_varint(data, pos)
+        s = bytes(data[pos:pos + n]).decode('utf-8')
+        strings.append(s)
+        return s, pos + n
+    elif tag == 0x72:  # r
+        idx, pos = _get_varint(data, pos)
+        return strings[idx], pos
+    elif tag == 0x62:  # b
+        n, pos = _get_varint(data, pos)
+        return bytes(data[pos:pos + n]), pos + n
+    elif tag == 0x6c:  # l
+        n, pos = _get_varint(data, pos)
+        out = []
+        for _ in range(n):
+            item, pos = _decode(data, pos, strings)
+            out.append(item)
+        return out, pos
+    elif tag == 0x6d:  # m
+        n, pos = _get_varint(data, pos)
+        out = dict()
+        for _ in range(n):
+            k, pos = _decode(data, pos, strings)
+            out[k], pos = _decode(data, pos, strings)
+        return out, pos
+    raise ValueError(f'Bad tag {tag} at {pos - 1}')
+
+
+def encode(obj):
+    """
+    Compact binary encoding of obj, made of None, bool, int, float, str,
+    bytes, lists (tuples) and dicts. A repeated string is encoded as a
+    reference to its first occurrence.
+    """
+    out = bytearray([CODEC_VERSION])
+    _encode(obj, out, dict())
+    return bytes(out)
+
+
+def decode(data):
+    if not data or data[0] != CODEC_VERSION:
+        raise ValueError('Unknown codec version')
+    obj, pos = _decode(data, 1, [])
+    if pos != len(data):
+        raise ValueError('Trailing data')
+    return obj
+
+
+class _Outgoing(object):
+    __slots__ = ('chunks', 'timer', 'tries')
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.timer = None
+        self.tries = 0
+
+
+class IpcChannel(object):
+    """
+    Sends (kind, obj) messages to a peer over a datagram transport such as
+    OSC: send(address, args) sends a datagram to the peer, the datagrams
+    of the peer are passed to on_chunk and on_ack (see bind_osc).
+    A message is encoded, split in chunks of CHUNK_SIZE bytes and sent as
+    (address '/ipc') msg_id, seq, total, chunk. The peer acknowledges the
+    complete message with (address '/ipc_ack') msg_id; without the
+    acknowledgement the message is sent again, RETRIES times. Payloads
+    of at least SPOOL_MIN bytes are written in a file of spool_dir and
+    sent as a chunk with total 0 and the file path: the receiver only
+    reads (and removes) spool files of its own spool_dir, that must be
+    the same as the sender's.
+    On the receiving side handlers[kind](obj) is called from the thread
+    calling on_chunk, once per message.
+    """
+
+    def __init__(self, send, handlers, spool_dir=None):
+        self.send = send
+        self.handlers = handlers
+        self.spool_dir = spool_dir
+        self._next_id = random.randrange(1 << 30)
+        self._outgoing = dict()
+        self._incoming = dict()
+        self._done = dict()
+        self._lock = threading.Lock()
+        # Notified when a message leaves _outgoing
+        self._sent = threading.Condition(self._lock)
+
+    def send_message(self, kind, obj):
+        data = encode([kind, obj])
+        with self._lock:
+            msg_id = self._next_id
+            self._next_id = (self._next_id + 1) % (1 << 31)
+        if self.spool_dir and len(data) >= SPOOL_MIN:
+            path = join(self.spool_dir, f'ipc_{os.getpid()}_{msg_id}.bin')
+            with open(path, 'wb') as f:
+                f.write(data)
+            chunks = [(msg_id, 0, 0, path.encode('utf-8'))]
+        else:
+            total = max(1, (len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+            chunks = [(msg_id, seq, total, data[seq * CHUNK_SIZE:(seq + 1) * CHUNK_SIZE])
+                      for seq in range(total)]
+        out = _Outgoing(chunks)
+        with self._lock:
+            self._outgoing[msg_id] = out
+        self._transmit(msg_id, out)
+        return msg_id
+
+    def _transmit(self, msg_id, out):
+        with self._lock:
+            if self._outgoing.get(msg_id) is not out:
+                return
+            if out.tries > RETRIES:
+                del self._outgoing[msg_id]
+                self._sent.notify_all()
+                Logger.error(f'Ipc: message {msg_id} not acknowledged')
+                return
+            out.tries += 1
+            out.timer = threading.Timer(ACK_TIMEOUT, self._transmit, (msg_id, out))
+            out.timer.daemon = True
+            out.timer.start()
+        for chunk in out.chunks:
+            self.send('/ipc', chunk)
+
+    def on_ack(self, msg_id, *args):
+        with self._lock:
+            out = self._outgoing.pop(msg_id, None)
+            self._sent.notify_all()
+        if out and out.timer:
+            out.timer.cancel()
+
+    def on_chunk(self, msg_id, seq, total, chunk, *args):
+        now = time.monotonic()
+        with self._lock:
+            if msg_id in self._done:
+                # Our ack was lost: the message was already delivered
+                data = None
+            else:
+                if total == 0:
+                    data = chunk
+                else:
+                    parts = self._incoming.setdefault(msg_id, [now, dict()])
+                    parts[0] = now
+                    parts[1][seq] = chunk
+                    data = None
+                    if len(parts[1]) == total:
+                        del self._incoming[msg_id]
+                        data = b''.join(parts[1][k] for k in range(total))
+                if data is not None:
+                    self._done[msg_id] = now
+                for k in [k for k, v in self._incoming.items() if now - v[0] > REASSEMBLY_TIMEOUT]:
+                    del self._incoming[k]
+                for k in [k for k, t in self._done.items() if now - t > REASSEMBLY_TIMEOUT]:
+                    del self._done[k]
+            complete = msg_id in self._done
+        if complete:
+            self.send('/ipc_ack', (msg_id,))
+        if data is not None:
+            if total == 0:
+                data = self._read_spooled(msg_id, data)
+                if data is None:
+                    return
+            try:
+                kind, obj = decode(data)
+            except Exception as ex:
+                Logger.error(f'Ipc: bad message {msg_id}: {ex!r}')
+                return
+            handler = self.handlers.get(kind)
+            if handler:
+                handler(obj)
+            else:
+                Logger.warning(f'Ipc: no handler for {kind}')
+
+    def _read_spooled(self, msg_id, chunk):
+        # Any local process can send us datagrams: the path must be the
+        # spool file of this message
+        try:
+            path = realpath(bytes(chunk).decode('utf-8'))
+        except ValueError:
+            path = None
+        mo = _SPOOL_NAME_RE.match(basename(path)) if path else None
+        if (not self.spool_dir or not mo or int(mo.group(1)) != msg_id or
+                dirname(path) != realpath(self.spool_dir)):
+            Logger.error(f'Ipc: message {msg_id}: not a spool file: {chunk!r}')
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.remove(path)
+        except OSError as ex:
+            Logger.error(f'Ipc: message {msg_id}: {ex!r}')
+            return None
+        return data
+
+    def close(self, timeout=0):
+        """
+        Stop sending: the messages not acknowledged within timeout
+        seconds are dropped.
+        """
+        with self._lock:
+            if timeout:
+                self._sent.wait_for(lambda: not self._outgoing, timeout)
+            for out in self._outgoing.values():
+                if out.timer:
+                    out.timer.cancel()
+            self._outgoing.clear()
+
+
+def bind_osc(osc, port, handlers, spool_dir=None):
+    """
+    Return an IpcChannel on the oscpy server osc talking with the peer
+    listening on 127.0.0.1:port.
+    Chunks travel as base64 OSC strings: oscpy sends bytes as strings
+    (cut at the first NUL, decoded with the server encoding) and cannot
+    pack blobs.
+    """
+    def send(address, args):
+        if address == '/ipc':
+            msg_id, seq, total, chunk = args
+            args = (msg_id, seq, total, base64.b64encode(chunk).decode('ascii'))
+        osc.send_message(address, args, '127.0.0.1', port)
+
+    def on_chunk(msg_id, seq, total, chunk, *args):
+        channel.on_chunk(msg_id, seq, total, base64.b64decode(chunk))
+
+    channel = IpcChannel(send, handlers, spool_dir)
+    osc.bind('/ipc', on_chunk)
+    osc.bind('/ipc_ack', channel.on_ack)
+    return channel
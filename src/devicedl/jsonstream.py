@@ -0,0 +1,122 @@
+import json
+import re
+
+_STRUCT = re.compile(rb'[{}\[\]",:]')
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+_OBJ = ord('{')
+_ARR = ord('[')
+_QUOTE = ord('"')
+_COLON = ord(':')
+_COMMA = ord(',')
+
+
+class MemberStreamParser(object):
+    """
+    Incremental parser for one JSON document fed in chunks.
+    Every member of the object found at path (a tuple of keys) is
+    decoded as soon as its text is complete and returned by feed as a
+    (key, value) pair. Only the text of the member being received is kept
+    in memory, everything else is scanned and dropped.
+    finish raises ValueError unless the document ended after the whole
+    object at path.
+    """
+
+    def __init__(self, path=('action', 'hosts')):
+        self.path = tuple(path)
+        self.nbytes = 0
+        self._buf = bytearray()
+        self._pos = 0
+        # (container char, path of the container)
+        self._stack = []
+        self._key = None
+        self._expect_key = False
+        self._member_key = None
+        self._member_start = -1
+        # The object at path was entered / left, the document ended
+        self.found = False
+        self.closed = False
+        self.done = False
+
+    def _in_target(self):
+        return self._stack and self._stack[-1][0] == _OBJ and self._stack[-1][1] == self.path
+
+    def _end_member(self, end, out):
+        if self._member_start >= 0:
+            out.append((self._member_key, json.loads(self._buf[self._member_start:end])))
+            self._member_start = -1
+            self._member_key = None
+
+    def feed(self, data):
+        out = []
+        buf = self._buf
+        buf += data
+        self.nbytes += len(data)
+        pos = self._pos
+        stack = self._stack
+        while True:
+            mo = _STRUCT.search(buf, pos)
+            if not mo:
+                pos = len(buf)
+                break
+            i = mo.start()
+            c = buf[i]
+            if c == _QUOTE:
+                ms = _STRING.match(buf, i)
+                if not ms:
+                    # String not complete yet
+                    pos = i
+                    break
+                pos = ms.end()
+                if self._expect_key:
+                    self._key = json.loads(buf[i:pos])
+                continue
+            pos = i + 1
+            if c == _COLON:
+                self._expect_key = False
+                if self._in_target():
+                    self._member_key = self._key
+                    self._member_start = pos
+            elif c == _COMMA:
+                if stack and stack[-1][0] == _OBJ:
+                    if self._in_target():
+                        self._end_member(i, out)
+                    self._expect_key = True
+            elif c == _OBJ or c == _ARR:
+                if stack:
+                    parent = stack[-1]
+                    stack.append((c, parent[1] + (self._key if parent[0] == _OBJ else None,)))
+                else:
+                    stack.append((c, ()))
+                if c == _OBJ and stack[-1][1] == self.path:
+                    self.found = True
+                self._expect_key = c == _OBJ
+                self._key = None
+            else:
+                if self._in_target():
+                    self._end_member(i, out)
+                    self.closed = True
+                if stack:
+                    stack.pop()
+                    if not stack:
+                        self.done = True
+                self._expect_key = False
+        # Drop what has already been scanned
+        cut = self._member_start if self._member_start >= 0 else pos
+        if cut:
+            del buf[:cut]
+            pos -= cut
+            if self._member_start >= 0:
+                self._member_start -= cut
+        self._pos = pos
+        return out
+
+    def finish(self):
+        """
+        Check that the whole document was received.
+        """
+        if not self.done:
+            raise ValueError(f'Truncated document after {self.nbytes} bytes')
+        if not self.found:
+            raise ValueError(f'No object at {".".join(self.path)}')
+        if not self.closed:
+            raise ValueError(f'Object at {".".join(self.path)} not closed')
@@ -0,0 +1,340 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from .utils import Logger, jclass, platform
+
+
+# Part of the keys of the IconCache: change it when the output of the renderers changes
+RENDER_VERSION = 3
+# Default font of the text icons; FALLBACK_FONTS are tried when it cannot
+# be loaded, then the font built in Pillow
+TEXT_FONT = "arial"
+FALLBACK_FONTS = ("DejaVuSans.ttf", "LiberationSans-Regular.ttf")
+TEXT_SIZE = 50
+TEXT_ORIGIN = (18, 18)
+TEXT_ICON_SIZE = (128, 128)
+# Glyphs kept in a GlyphAtlas: labels made only of these are pasted together
+ATLAS_CHARS = "0123456789+-.,:%"
+
+
+@lru_cache(maxsize=None)
+def _font(name, size):
+    from PIL import ImageFont
+    for fname in (name,) + FALLBACK_FONTS:
+        try:
+            font = ImageFont.truetype(fname, size)
+        except OSError:
+            continue
+        if fname != name:
+            Logger.warning(f"Font {name} not found: using {fname}")
+        return font
+    Logger.warning(f"Font {name} not found: using the default one")
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 has only the bitmap font
+        return ImageFont.load_default()
+
+
+class GlyphAtlas(object):
+    """
+    The ATLAS_CHARS glyphs of a font rasterised once in one color.
+    """
+
+    def __init__(self, font, col):
+        from PIL import Image, ImageDraw
+        self.glyphs = dict()
+        for ch in ATLAS_CHARS:
+            _, _, r, b = font.getbbox(ch)
+            im = Image.new('RGBA', (max(r, 1), max(b, 1)), (255, 0, 0, 0))
+            ImageDraw.Draw(im).text((0, 0), ch, fill=col, font=font)
+            self.glyphs[ch] = (im, font.getlength(ch))
+
+    def can_render(self, txt):
+        return all(ch in self.glyphs for ch in txt)
+
+    def render(self, img, xy, txt):
+        x, y = xy
+        for ch in txt:
+            im, advance = self.glyphs[ch]
+            img.alpha_composite(im, (round(x), y))
+            x += advance
+        return img
+
+
+@lru_cache(maxsize=None)
+def _atlas(name, size, col):
+    return GlyphAtlas(_font(name, size), col)
+
+
+def render_text(txt, col, fom, font=TEXT_FONT):
+    if platform == "android":
+        FileOutputStream = jclass("java.io.FileOutputStream")
+        Bitmap = jclass("android.graphics.Bitmap")
+        BitmapConfig = jclass("android.graphics.Bitmap$Config")
+        BitmapCompressFormat = jclass("android.graphics.Bitmap$CompressFormat")
+        Canvas = jclass("android.graphics.Canvas")
+        PorterDuffMode = jclass("android.graphics.PorterDuff$Mode")
+        Paint = jclass("android.graphics.Paint")
+        PaintAlign = jclass("android.graphics.Paint$Align")
+        Color = jclass("android.graphics.Color")
+        paint = Paint(Paint.ANTI_ALIAS_FLAG)
+        paint.setTextSize(55)
+        paint.setColor(col)
+        paint.setTextAlign(PaintAlign.LEFT)
+        baseline = -paint.ascent()  # ascent() is negative
+        width = round(paint.measureText(txt))  # round
+        height = round(baseline + paint.descent())
+        image = Bitmap.createBitmap(width, height, BitmapConfig.ARGB_8888)
+        canvas = Canvas(image)
+        canvas.drawColor(Color.TRANSPARENT, PorterDuffMode.CLEAR)
+        canvas.drawText(txt, 0, baseline, paint)
+        image.compress(BitmapCompressFormat.PNG, 100, FileOutputStream(fom))
+    else:
+        from PIL import Image, ImageDraw
+        img = Image.new('RGBA', TEXT_ICON_SIZE, (255, 0, 0, 0))
+        col = tuple(col)
+        atlas = _atlas(font, TEXT_SIZE, col)
+        if atlas.can_render(txt):
+            atlas.render(img, TEXT_ORIGIN, txt)
+        else:
+            d = ImageDraw.Draw(img)
+            d.text(TEXT_ORIGIN, txt, fill=col, font=_font(font, TEXT_SIZE))
+        img.save(fom)
+    return fom
+
+
+def tint_variants(fim, colors, foms):
+    """
+    Decode fim once and write in foms[i] its variant tinted with colors[i].
+    Return foms.
+    """
+    if platform == "android":
+        FileOutputStream = jclass("java.io.FileOutputStream")
+        BitmapFactory = jclass("android.graphics.BitmapFactory")
+        BitmapCompressFormat = jclass("android.graphics.Bitmap$CompressFormat")
+        Canvas = jclass("android.graphics.Canvas")
+        PorterDuffMode = jclass("android.graphics.PorterDuff$Mode")
+        Paint = jclass("android.graphics.Paint")
+        PorterDuffColorFilter = jclass("android.graphics.PorterDuffColorFilter")
+        src = BitmapFactory.decodeFile(fim)
+        for col, fom in zip(colors, foms):
+            bm = src.copy(src.getConfig(), True)
+            paint = Paint()
+            paint.setColorFilter(PorterDuffColorFilter(col, PorterDuffMode.SRC_IN))
+            canvas = Canvas(bm)
+            canvas.drawBitmap(bm, 0, 0, paint)
+            bm.compress(BitmapCompressFormat.PNG, 100, FileOutputStream(fom))
+        return foms
+    return tint_set([fim], colors, [foms])
+
+
+def _decode_scaled(fim, size):
+    """
+    Decode fim scaled down to fit in size x size pixels: an Android Bitmap
+    or an RGBA PIL image.
+    """
+    if platform == "android":
+        BitmapFactory = jclass("android.graphics.BitmapFactory")
+        BitmapFactoryOptions = jclass("android.graphics.BitmapFactory$Options")
+        options = BitmapFactoryOptions()
+        options.inJustDecodeBounds = True
+        BitmapFactory.decodeFile(fim, options)
+        # Let the decoder skip pixels: power of 2 not smaller than size
+        sample = 1
+        while max(options.outWidth, options.outHeight) // (sample * 2) >= size:
+            sample *= 2
+        options.inJustDecodeBounds = False
+        options.inSampleSize = sample
+        return _scaled(BitmapFactory.decodeFile(fim, options), size)
+    else:
+        from PIL import Image
+        im = Image.open(fim)
+        im.draft('RGBA', (size, size))
+        return _scaled(im.convert('RGBA'), size)
+
+
+def _scaled(img, size):
+    if platform == "android":
+        Bitmap = jclass("android.graphics.Bitmap")
+        scale = size / max(img.getWidth(), img.getHeight())
+        if scale < 1:
+            img = Bitmap.createScaledBitmap(img, max(1, round(img.getWidth() * scale)),
+                                            max(1, round(img.getHeight() * scale)), True)
+        return img
+    else:
+        img = img.copy()
+        img.thumbnail((size, size))
+        return img
+
+
+def thumbnail(fim, size):
+    """
+    Decode fim scaled down to fit in size x size pixels. Return
+    (width, height, RGBA bytes) with the rows from top to bottom.
+    """
+    img = _decode_scaled(fim, size)
+    if platform == "android":
+        ByteBuffer = jclass("java.nio.ByteBuffer")
+        buf = ByteBuffer.allocate(img.getByteCount())
+        img.copyPixelsToBuffer(buf)
+        return img.getWidth(), img.getHeight(), bytes(b & 0xff for b in buf.array())
+    else:
+        return img.width, img.height, img.tobytes()
+
+
+def scale_variants(fim, sizes, foms):
+    """
+    Decode fim once and write in foms[i] its copy scaled down to fit in
+    sizes[i] x sizes[i] pixels. Return foms.
+    """
+    img = _decode_scaled(fim, max(sizes))
+    for size, fom in sorted(zip(sizes, foms), reverse=True):
+        img = _scaled(img, size)
+        # Written aside and renamed: the same variant may be built by two threads
+        tmp = f'{fom}.{threading.get_ident()}.tmp'
+        if platform == "android":
+            FileOutputStream = jclass("java.io.FileOutputStream")
+            BitmapCompressFormat = jclass("android.graphics.Bitmap$CompressFormat")
+            out = FileOutputStream(tmp)
+            img.compress(BitmapCompressFormat.PNG, 100, out)
+            out.close()
+        else:
+            img.save(tmp, 'PNG')
+        os.replace(tmp, fom)
+    return foms
+
+
+def tint_stack(data, colors):
+    """
+    data is a (..., height, width, 4) RGBA array: a single icon or a stack
+    of same-size icons. Return an array with a leading axis of len(colors)
+    where the white pixels of data are replaced by every color (alpha is
+    left alone).
+    """
+    import numpy as np
+    data = np.asarray(data, dtype=np.uint8)
+    white = (data[..., :3] == 255).all(axis=-1)[..., None]
+    rgb = np.asarray(colors, dtype=np.uint8).reshape((-1,) + (1,) * (data.ndim - 1) + (3,))
+    out = np.empty((len(rgb),) + data.shape, dtype=np.uint8)
+    out[..., :3] = np.where(white, rgb, data[..., :3])
+    out[..., 3] = data[..., 3]
+    return out
+
+
+def tint_set(fims, colors, foms):
+    """
+    Tint every icon in fims with every RGB color in colors: foms[i][j] is
+    where the variant of fims[i] with colors[j] is written. Icons of the
+    same size are tinted together. Return the list of written files.
+    """
+    from PIL import Image
+    import numpy as np
+    groups = dict()
+    for fim, fomv in zip(fims, foms):
+        im = Image.open(fim).convert('RGBA')
+        groups.setdefault(im.size, []).append((np.asarray(im), fomv))
+    out = []
+    for group in groups.values():
+        tinted = tint_stack(np.stack([data for data, _ in group]), colors)
+        for i, (_, fomv) in enumerate(group):
+            for j, fom in enumerate(fomv):
+                Image.fromarray(tinted[j, i]).save(fom)
+                out.append(fom)
+    return out
+
+
+class RenderQueue(object):
+    """
+    Renders icons on a pool of at most max_workers workers: processes on
+    desktop (PIL work holds the GIL), threads on Android (Java objects
+    cannot be moved to another process).
+    Requests for an icon that is already being rendered share its future.
+    wait blocks until every render (and its on_done) has ended.
+    on_written(path) is called for every file written by a render (the
+    value returned by render: a path or a list of paths) before it stops
+    being in flight.
+    """
+
+    def __init__(self, max_workers=None, on_written=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.on_written = on_written
+        self._executor = None
+        self._inflight = dict()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._idle = threading.Condition(self._lock)
+
+    def __contains__(self, fom):
+        return fom in self._inflight
+
+    def _get_executor(self):
+        if not self._executor:
+            if platform == 'android':
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            else:
+                # spawn: forking a process with a GL context is not safe
+                self._executor = ProcessPoolExecutor(self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, fom, render, *args, also=(), on_done=None):
+        """
+        Render fom calling render(*args) in the pool; also are the other
+        files written by the same call. on_done(fom, fut) is called (from
+        a pool thread) when a new render ends.
+        """
+        with self._lock:
+            fut = self._inflight.get(fom)
+            if fut is not None:
+                return fut
+            fut = self._inflight[fom] = self._get_executor().submit(render, *args)
+            self._active += 1
+            for other in also:
+                self._inflight.setdefault(other, fut)
+        fut.add_done_callback(lambda f: self._done((fom,) + tuple(also), f, on_done))
+        return fut
+
+    def _done(self, foms, fut, on_done):
+        try:
+            self._finish(foms, fut, on_done)
+        finally:
+            with self._lock:
+                self._active -= 1
+                if not self._active:
+                    self._idle.notify_all()
+
+    def _finish(self, foms, fut, on_done):
+        fom = foms[0]
+        if self.on_written and not fut.cancelled() and not fut.exception():
+            res = fut.result()
+            for f in (res if isinstance(res, list) else [res]):
+                self.on_written(f)
+        with self._lock:
+            for other in foms:
+                if self._inflight.get(other) is fut:
+                    del self._inflight[other]
+            if not fut.cancelled() and isinstance(fut.exception(), BrokenExecutor):
+                # A worker died: start a new pool at the next submit
+                self._executor = None
+        if fut.cancelled():
+            return
+        if fut.exception():
+            Logger.error(f'RenderQueue: cannot render {fom}: {fut.exception()!r}')
+        if on_done:
+            on_done(fom, fut)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the renders in progress. Return False on timeout.
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,273 @@
+import re
+from array import array
+from bisect import bisect_left
+from sys import intern
+
+# Fields shared by all the rows of a device remote
+SECTION_KEYS = ('dname', 'dname2', 'group', 'filter', 'dtype', 'host', 'tcpport', 'udpport')
+# Fields of every row
+ROW_KEYS = ('name', 'msg', 'ico', 'ico_pending', 'sel')
+_SECTION_POS = {k: i for i, k in enumerate(SECTION_KEYS)}
+_WORD_RE = re.compile(r'[0-9a-z]+')
+
+
+def _mask(indices, n):
+    b = bytearray((n + 7) // 8)
+    for i in indices:
+        b[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(b, 'little')
+
+
+def bit_indices(mask):
+    """
+    Indices of the bits set in mask, in ascending order.
+    """
+    b = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for k, byte in enumerate(b):
+        while byte:
+            low = byte & -byte
+            yield (k << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+class NameIndex(object):
+    """
+    Search index of row names: queries of at least 3 characters match the
+    names containing them (trigram postings), shorter ones the names with
+    a word starting with them. A query extending the previous one only
+    filters its result.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.trigrams = dict()
+        self.words = []
+        self._words_sorted = True
+        self._last = (None, None)
+
+    def __len__(self):
+        return len(self.names)
+
+    def extend(self, names):
+        for name in names:
+            i = len(self.names)
+            name = name.lower()
+            self.names.append(name)
+            for g in {name[j:j + 3] for j in range(len(name) - 2)}:
+                self.trigrams.setdefault(g, array('I')).append(i)
+            self.words.extend((w, i) for w in set(_WORD_RE.findall(name)))
+        self._words_sorted = False
+        self._last = (None, None)
+
+    def search(self, q):
+        """
+        Return the sorted list of the indices of the names matching q.
+        """
+        q = q.lower()
+        last_q, last = self._last
+        if last_q is not None and len(last_q) >= 3 and q.startswith(last_q):
+            out = [i for i in last if q in self.names[i]]
+        elif len(q) >= 3:
+            postings = sorted((self.trigrams.get(q[j:j + 3], ()) for j in range(len(q) - 2)), key=len)
+            cand = set(postings[0])
+            for p in postings[1:]:
+                if not cand:
+                    break
+                cand.intersection_update(p)
+            out = sorted(i for i in cand if q in self.names[i])
+        else:
+            if not self._words_sorted:
+                self.words.sort()
+                self._words_sorted = True
+            out = set()
+            for k in range(bisect_left(self.words, (q, -1)), len(self.words)):
+                w, i = self.words[k]
+                if not w.startswith(q):
+                    break
+                out.add(i)
+            out = sorted(out)
+        self._last = (q, out)
+        return out
+
+
+class Row(object):
+    """
+    Dict like view of a row of a RowStore: the row dict is built only when
+    all its fields are needed (keys, items).
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.store.value(self.index, key)
+
+    def __setitem__(self, key, value):
+        self.store.set_value(self.index, key, value)
+
+    def __contains__(self, key):
+        return key in _SECTION_POS or key in ROW_KEYS
+
+    def get(self, key, default=None):
+        try:
+            return self.store.value(self.index, key)
+        except KeyError:
+            return default
+
+    def keys(self):
+        return SECTION_KEYS + ROW_KEYS
+
+    def items(self):
+        return self.store.row(self.index).items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(SECTION_KEYS) + len(ROW_KEYS)
+
+
+class RowStore(object):
+    """
+    Shortcut rows stored by column: the fields of a device remote are held
+    once in sections, the others in one list (or array) per field, the
+    selection in the bits of selected.
+    Items are Row views of the visible rows: all of them, or the ones
+    passed to set_filter; extend takes row dicts.
+    """
+
+    def __init__(self, rows=()):
+        self.sections = []
+        self._section_index = dict()
+        self.section = array('I')
+        self.name = []
+        self.msg = []
+        self.ico = []
+        self.ico_pending = []
+        self.selected = 0
+        self.visible = None
+        self._index = NameIndex()
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.msg) if self.visible is None else len(self.visible)
+
+    def _store_index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return index if self.visible is None else self.visible[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, self._store_index(i)) for i in range(*index.indices(len(self)))]
+        return Row(self, self._store_index(index))
+
+    def __iter__(self):
+        return (Row(self, i) for i in (range(len(self.msg)) if self.visible is None else self.visible))
+
+    def set_filter(self, indices):
+        """
+        Show only the rows at indices (of the whole store), or all of them
+        if indices is None.
+        """
+        self.visible = None if indices is None else array('I', indices)
+
+    def search(self, q):
+        """
+        Return the sorted indices of the rows whose name (with its group)
+        matches q: see NameIndex.
+        """
+        idx = self._index
+        if len(idx) < len(self.msg):
+            idx.extend(self.label(i) for i in range(len(idx), len(self.msg)))
+        return idx.search(q)
+
+    def label(self, index):
+        group = self.sections[self.section[index]][_SECTION_POS['group']]
+        return f'{group}: {self.name[index]}' if group else self.name[index]
+
+    def is_selected(self, index):
+        return bool(self.selected >> index & 1)
+
+    def select(self, index, value=True):
+        if value:
+            self.selected |= 1 << index
+        else:
+            self.selected &= ~(1 << index)
+
+    def select_all(self):
+        """
+        Select the visible rows: with a filter the hidden ones are left
+        as they are.
+        """
+        if self.visible is None:
+            self.selected = (1 << len(self.msg)) - 1
+        else:
+            self.select_many(self.visible)
+
+    def select_none(self):
+        self.selected = 0
+
+    def select_many(self, indices):
+        self.selected |= _mask(indices, len(self.msg))
+
+    def selected_indices(self):
+        return bit_indices(self.selected)
+
+    def extend(self, rows):
+        for r in rows:
+            sec = tuple(r.get(k) for k in SECTION_KEYS)
+            idx = self._section_index.get(sec)
+            if idx is None:
+                idx = self._section_index[sec] = len(self.sections)
+                self.sections.append(sec)
+            self.section.append(idx)
+            self.name.append(r['name'])
+            self.msg.append(r['msg'])
+            self.ico.append(intern(r['ico']))
+            self.ico_pending.append(intern(r.get('ico_pending') or ''))
+            if r.get('sel'):
+                self.select(len(self.msg) - 1)
+
+    def value(self, index, key):
+        pos = _SECTION_POS.get(key)
+        if pos is not None:
+            return self.sections[self.section[index]][pos]
+        elif key == 'sel':
+            return self.is_selected(index)
+        elif key in ROW_KEYS:
+            return getattr(self, key)[index]
+        raise KeyError(key)
+
+    def set_value(self, index, key, value):
+        if key == 'sel':
+            self.select(index, value)
+        elif key in ('ico', 'ico_pending'):
+            getattr(self, key)[index] = intern(value)
+        elif key in ROW_KEYS:
+            getattr(self, key)[index] = value
+        else:
+            raise KeyError(key)
+
+    def row(self, index):
+        d = dict(zip(SECTION_KEYS, self.sections[self.section[index]]))
+        d.update(name=self.name[index], msg=self.msg[index], ico=self.ico[index],
+                 ico_pending=self.ico_pending[index], sel=self.is_selected(index))
+        return d
+
+    def resolve_pending(self, done):
+        """
+        Rows whose pending icon is in done get it as icon. Return whether
+        any row changed.
+        """
+        changed = False
+        for i, pending in enumerate(self.ico_pending):
+            if pending and pending in done:
+                self.ico[i] = pending
+                self.ico_pending[i] = ''
+                changed = True
+        return changed
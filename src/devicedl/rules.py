@@ -0,0 +1,91 @@
+import re
+
+# How the icon of a shortcut is made
+ICON_IR = 'ir'
+ICON_ONOFF = 'onoff'
+ICON_TEXT = 'text'
+
+_PREFIXED_RE = re.compile(r'^@[a-z]_([0-9]+)_(.*)')
+_REPEAT_RE = re.compile(r'^([^0-9]+)[0-9]+([\-\+])$')
+NUMBERED_RE = re.compile(r'^([0-9]+)_')
+
+RULES = dict()
+
+
+class ShortcutRule(object):
+    """
+    Shortcut generation for a family of hub device types.
+    shortcuts yields (name, command, remote) for every shortcut of a
+    device; the command is sent to the hub as "@<n> <command>".
+    """
+    icon = ICON_TEXT
+
+    def shortcuts(self, dev, remote):
+        return ()
+
+    def normalise(self, shnm):
+        mo = _PREFIXED_RE.match(shnm)
+        return "@" + mo.group(1) + "_" + mo.group(2) if mo else shnm
+
+    def icon_name(self, shnm):
+        return shnm
+
+
+class IrRule(ShortcutRule):
+    icon = ICON_IR
+
+    def shortcuts(self, dev, remote):
+        if dev.sh is not None and remote == 'sh':
+            for shnm in dev.sh:
+                yield shnm, f'emitir {dev.name} {shnm}', ''
+        elif dev.remotes is not None and remote:
+            for shnm in dev.remotes.get(remote, ()):
+                yield shnm, f'emitir {dev.name} {remote}:{shnm}', remote
+
+    def normalise(self, shnm):
+        shnm = super(IrRule, self).normalise(shnm)
+        return shnm[1:] if shnm[0:1] == '@' else shnm
+
+    def icon_name(self, shnm):
+        # vol10+ and vol10- share the icons of vol+ and vol-
+        mo = _REPEAT_RE.match(shnm)
+        return (mo.group(1) + mo.group(2) if mo else shnm).lower()
+
+
+class VirtualRule(ShortcutRule):
+    def shortcuts(self, dev, remote):
+        for stvalue, shnm in dev.nicks.items():
+            yield shnm, f'statechange {dev.name} {stvalue}', ''
+
+
+class LevelRule(ShortcutRule):
+    def shortcuts(self, dev, remote):
+        for stvalue in range(100):
+            yield str(stvalue), f'statechange {dev.name} {stvalue}', ''
+
+
+class SwitchRule(ShortcutRule):
+    icon = ICON_ONOFF
+
+    def shortcuts(self, dev, remote):
+        yield "ON", f'statechange {dev.name} 1', ''
+        yield "OFF", f'statechange {dev.name} 0', ''
+
+
+def register_rule(rule, *keys):
+    """
+    Use rule for the devices matching keys: a key is a device type or a
+    (device type, subtype) tuple.
+    """
+    for key in keys:
+        RULES[key] = rule
+
+
+def rule_for(dev):
+    return RULES.get((dev.type, dev.subtype)) or RULES.get(dev.type)
+
+
+register_rule(IrRule(), 'DeviceRM', 'DeviceAllOne', 'DeviceCT10', 'DeviceUpnpIRTA2', 'DeviceUpnpIRRC', 'DeviceSamsungCtl')
+register_rule(VirtualRule(), 'DeviceVirtual')
+register_rule(LevelRule(), ('DevicePrimelan', 1))
+register_rule(SwitchRule(), 'DeviceS20', 'DeviceTasmotaswitch', ('DevicePrimelan', 0), ('DevicePrimelan', 2))
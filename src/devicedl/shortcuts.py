@@ -0,0 +1,145 @@
+import traceback
+
+from .render import TEXT_FONT, render_text, tint_variants
+from .rules import ICON_IR, ICON_ONOFF, ICON_TEXT, NUMBERED_RE, rule_for
+from .utils import Logger, jclass, platform
+
+DEFAULT_COLOR = 'Magenta'
+
+
+def color_map():
+    """
+    Colors of the generated icons by name: android.graphics.Color values
+    on Android, RGB tuples elsewhere.
+    """
+    if platform == 'android':
+        Color = jclass('android.graphics.Color')
+        return {
+            "Green": Color.GREEN,
+            "Red": Color.RED,
+            "Yellow": Color.YELLOW,
+            "Blue": Color.BLUE,
+            "Magenta": Color.MAGENTA}
+    return {
+        "Green": (0, 255, 0),
+        "Red": (255, 0, 0),
+        "Yellow": (240, 255, 0),
+        "Blue": (0, 0, 255),
+        "Magenta": (255, 0, 255)}
+
+
+class ShortcutBuilder(object):
+    """
+    Builds the shortcut rows of the devices of a DeviceCatalog with their
+    icons: source icons are looked up in icon_index, tinted and text icons
+    are rendered by render_queue into icon_cache. A row whose icon is
+    still being rendered has the default icon and the path of the new one
+    in ico_pending; on_icons(foms) is called (from a pool thread) when
+    new icons are ready. The files written by render_queue must be added
+    to icon_cache by its on_written. Text icons are drawn with font (not
+    on Android).
+    """
+
+    def __init__(self, icon_index, icon_cache, render_queue, color=DEFAULT_COLOR, on_icons=None,
+                 font=TEXT_FONT):
+        self.icon_index = icon_index
+        self.icon_cache = icon_cache
+        self.render_queue = render_queue
+        self.color = color
+        self.on_icons = on_icons
+        self.font = font
+        self._colors = None
+        self.icon_makers = {
+            ICON_IR: self.ir_icon,
+            ICON_ONOFF: self.onoff_icon,
+            ICON_TEXT: self.text_icon}
+
+    @property
+    def colors(self):
+        # Resolved at the first icon: on Android it needs a Java class
+        if self._colors is None:
+            self._colors = color_map()
+        return self._colors
+
+    def device_shortcuts(self, outobj, dev, remote, group):
+        """
+        Append to outobj the rows of the shortcuts of dev (of its remote
+        if not None); group is shown with the name when not empty.
+        """
+        Logger.debug("DEV " + dev.fullname + ":" + dev.type + "/" + str(remote))
+        rule = rule_for(dev)
+        if rule:
+            for k, (shnm, command, remn) in enumerate(rule.shortcuts(dev, remote), 1):
+                outobj.append(self.define_sh(dev, rule, shnm, f"@{k} {command}", remn, group))
+
+    def define_sh(self, dev, rule, shnm, msg, remote='', group=''):
+        shnm = rule.normalise(shnm)
+        tp = dev.type[6:].lower()
+        col = self.color
+        try:
+            fom = self.icon_makers[rule.icon](dev, rule, tp, shnm, col)
+        except Exception:
+            fom = ""
+            traceback.print_exc()
+        # Icons still being rendered are shown with the default one until on_icons
+        pending = fom if fom in self.render_queue else ''
+        return dict(ico=self.icon_index.icon('default.png') if not fom or pending else fom,
+                    ico_pending=pending,
+                    dname=dev.name, dname2=remote, name=shnm, msg=msg, sel=False, group=group,
+                    filter=group or dev.fullname + ('/' + remote if remote else ''),
+                    dtype=dev.type, host=dev.hub.host, tcpport=dev.hub.tcpport, udpport=dev.hub.udpport)
+
+    def generated_icon(self, src, col, text, render, *args):
+        # Rendered calling render(*args, fom, font)
+        cache = self.icon_cache
+        key = cache.key(src, self.colors[col], text, self.font)
+        fom = cache.icon(key)
+        if not cache.has(key):
+            Logger.debug("Creating " + fom)
+            self.render_queue.submit(fom, render, *args, fom, self.font,
+                                     on_done=self.on_icon_rendered)
+        return fom
+
+    def tinted_icon(self, src, col):
+        # Every palette variant is written by the same job: changing color
+        # does not decode the source again
+        cache = self.icon_cache
+        key = cache.key(src, self.colors[col])
+        fom = cache.icon(key)
+        if not cache.has(key):
+            Logger.debug("Creating " + fom)
+            colors = list(self.colors.values())
+            foms = [cache.icon(cache.key(src, c)) for c in colors]
+            self.render_queue.submit(fom, tint_variants, src, colors, foms,
+                                     also=foms, on_done=self.on_icon_rendered)
+        return fom
+
+    def on_icon_rendered(self, fom, fut):
+        if not fut.exception():
+            res = fut.result()
+            if self.on_icons:
+                self.on_icons(res if isinstance(res, list) else [res])
+
+    def ir_icon(self, dev, rule, tp, shnm, col):
+        idx = self.icon_index
+        iconm = rule.icon_name(shnm)
+        Logger.debug("Searching " + dev.name + ":" + shnm)
+        if idx.has(iconm + "_ac.png"):
+            return idx.icon(iconm + "_ac.png")
+        elif idx.has(iconm + ".png"):
+            return self.tinted_icon(idx.icon(iconm + ".png"), col)
+        Logger.debug("Not found " + dev.name + ":" + iconm)
+        mo = NUMBERED_RE.match(iconm)
+        if mo:
+            nums = mo.group(1)
+            return self.generated_icon(None, col, nums, render_text, nums, self.colors[col])
+        elif idx.has(tp + ".png"):
+            return self.tinted_icon(idx.icon(tp + ".png"), col)
+        return ""
+
+    def onoff_icon(self, dev, rule, tp, shnm, col):
+        col = "Green" if shnm == "ON" else "Red"
+        return self.tinted_icon(self.icon_index.icon(tp + ".png"), col)
+
+    def text_icon(self, dev, rule, tp, shnm, col):
+        return self.generated_icon(None, col, shnm, render_text, shnm, self.colors[col])
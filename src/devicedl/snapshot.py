@@ -0,0 +1,82 @@
+import hashlib
+import os
+import struct
+import time
+from os.path import join
+
+from .catalog import Device
+from .ipc import decode, encode
+from .utils import Logger
+
+SNAPSHOT_MAGIC = b'DDLS'
+# 3: payload encoded with ipc.encode instead of pickle
+SNAPSHOT_VERSION = 3
+# magic, version, creation time, sha1 of the payload
+_HEADER = struct.Struct('<4sHd20s')
+
+
+class Snapshot(object):
+    __slots__ = ('digest', 'created', 'devices')
+
+    def __init__(self, digest, created, devices):
+        self.digest = digest
+        self.created = created
+        self.devices = devices
+
+
+def snapshot_path(data_dir, host, port):
+    return join(data_dir, f'devices_{host}_{port}.snap')
+
+
+def _payload(devices):
+    # Data only: snapshots may be on storage other apps can write
+    return encode([(d.name, d.type, d.subtype, d.nicks, d.sh, d.remotes) for d in devices])
+
+
+def _devices(payload):
+    devices = []
+    for name, type, subtype, nicks, sh, remotes in decode(payload):
+        devices.append(Device(name, type, subtype=subtype, nicks=nicks,
+                              sh=tuple(sh) if sh is not None else None,
+                              remotes={remn: tuple(keys) for remn, keys in remotes.items()}
+                              if remotes is not None else None))
+    return devices
+
+
+def snapshot_digest(devices):
+    return hashlib.sha1(_payload(devices)).digest()
+
+
+def load_snapshot(path):
+    """
+    Return the Snapshot stored in path or None if it is missing, corrupted
+    or written by a different SNAPSHOT_VERSION.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            payload = f.read()
+        magic, version, created, digest = _HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            Logger.info(f'Snapshot: ignoring {path} (version {version})')
+            return None
+        if hashlib.sha1(payload).digest() != digest:
+            Logger.warning(f'Snapshot: {path} is corrupted')
+            return None
+        return Snapshot(digest, created, _devices(payload))
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        Logger.warning(f'Snapshot: cannot load {path}: {ex!r}')
+        return None
+
+
+def save_snapshot(path, devices):
+    payload = _payload(devices)
+    snap = Snapshot(hashlib.sha1(payload).digest(), time.time(), devices)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snap.created, snap.digest))
+        f.write(payload)
+    os.replace(tmp, path)
+    return snap
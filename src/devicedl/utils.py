@@ -0,0 +1,34 @@
+import logging
+from functools import lru_cache
+from os import environ
+from sys import platform as _sys_platform
+
+# Same logger kivy.logger.Logger wraps: messages end up in the app log
+# without having to import kivy in this package.
+Logger = logging.getLogger('kivy')
+
+
+def _get_platform():
+    # Same detection as kivy.utils.platform
+    if 'ANDROID_ARGUMENT' in environ:
+        return 'android'
+    elif _sys_platform in ('win32', 'cygwin'):
+        return 'win'
+    elif _sys_platform == 'darwin':
+        return 'macosx'
+    elif _sys_platform.startswith(('linux', 'freebsd')):
+        return 'linux'
+    return 'unknown'
+
+
+platform = _get_platform()
+
+
+@lru_cache(maxsize=None)
+def jclass(name):
+    """
+    Java class name (autoclass), resolved once per process: jnius
+    reflection is slow and is imported only when first needed.
+    """
+    from jnius import autoclass
+    return autoclass(name)
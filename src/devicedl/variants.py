@@ -0,0 +1,70 @@
+from .render import scale_variants
+from .utils import Logger
+
+# Pixel size of launcher icons (48dp) in the Android density buckets
+LAUNCHER_SIZES = {
+    'mdpi': 48,
+    'hdpi': 72,
+    'xhdpi': 96,
+    'xxhdpi': 144,
+    'xxxhdpi': 192}
+# Pixel size of the icons in desktop exports
+EXPORT_SIZE = 128
+
+
+def launcher_size(density):
+    """
+    Pixel size of a launcher icon for a screen density (1 is mdpi): the
+    smallest bucket that is not smaller than 48dp, or the largest one.
+    """
+    for size in sorted(LAUNCHER_SIZES.values()):
+        if size >= 48 * density:
+            return size
+    return max(LAUNCHER_SIZES.values())
+
+
+class IconVariants(object):
+    """
+    Copies of icons scaled down to the size of a destination (launcher,
+    row, export), kept in an IconCache and built once per source content:
+    later steps read small files instead of decoding large ones.
+    Methods can be called from worker threads; build writes files.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _key(self, src, size):
+        return self.cache.key(src, None, f'variant {size}')
+
+    def get(self, src, size):
+        return self.build(src, (size,))[0]
+
+    def build(self, src, sizes):
+        """
+        Return the paths of the variants of src for sizes, building the
+        missing ones with a single decode of src. On error src is returned
+        in place of its variants.
+        """
+        keys = [self._key(src, size) for size in sizes]
+        foms = [self.cache.icon(key) for key in keys]
+        missing = [(size, fom) for size, fom, key in zip(sizes, foms, keys) if not self.cache.has(key)]
+        if missing:
+            try:
+                scale_variants(src, [m[0] for m in missing], [m[1] for m in missing])
+            except Exception as ex:
+                Logger.warning(f'IconVariants: cannot scale {src}: {ex!r}')
+                return [src] * len(sizes)
+            for _, fom in missing:
+                self.cache.add(fom)
+        return foms
+
+    def get_all(self, srcs, size):
+        """
+        Return the list of the variants of srcs for size.
+        """
+        done = dict()
+        for src in srcs:
+            if src not in done:
+                done[src] = self.get(src, size)
+        return [done[src] for src in srcs]
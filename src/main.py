@@ -9,36 +9,40 @@ When the user next runs the programs, their changes are restored.
 
 import asyncio
 import json
-import ntpath
 import os
-import re
-import select
-import shutil
 import socket
 import textwrap
-import threading
 import time
 import traceback
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+from functools import partial
 from os.path import dirname, exists, join
-from urllib.parse import quote
 
-from jnius import autoclass
-from kivy.app import App
-from kivy.lang import Builder
-from kivy.logger import Logger
-from kivy.uix.popup import Popup
-from kivy.uix.settings import SettingsWithTabbedPanel
-from kivy.utils import platform
-from oscpy.client import send_message
-from oscpy.server import OSCThreadServer
-from toast import toast
-
-if platform == "android":
-    from android.permissions import request_permissions, Permission
-    request_permissions([Permission.INTERNET, Permission.READ_EXTERNAL_STORAGE,
-                         Permission.WRITE_EXTERNAL_STORAGE])
+# Start of the time to interactive: Kivy is most of the import time
+_IMPORT_STARTED = time.perf_counter()
+
+from kivy.app import App  # noqa: E402
+from kivy.clock import Clock  # noqa: E402
+from kivy.lang import Builder  # noqa: E402
+from kivy.logger import Logger  # noqa: E402
+from kivy.metrics import Metrics  # noqa: E402
+from kivy.utils import platform  # noqa: E402
+from devicedl.commands import CommandDispatcher  # noqa: E402
+from devicedl.export import export_filename, export_shortcuts, shortcut_template  # noqa: E402
+from devicedl.hubclient import HubConnection  # noqa: E402
+from devicedl.catalog import DeviceCatalog, fetch_devices, split_filters  # noqa: E402
+from devicedl.hubs import parse_hubs  # noqa: E402
+from devicedl.icons import IconIndex  # noqa: E402
+from devicedl.ipc import bind_osc  # noqa: E402
+from devicedl.iconcache import IconCache  # noqa: E402
+from devicedl.render import RENDER_VERSION, RenderQueue  # noqa: E402
+from devicedl.rows import RowStore  # noqa: E402
+from devicedl.shortcuts import ShortcutBuilder  # noqa: E402
+from devicedl.snapshot import load_snapshot, save_snapshot, snapshot_digest, snapshot_path  # noqa: E402
+from devicedl.variants import EXPORT_SIZE, IconVariants, launcher_size  # noqa: E402
+from devicedl.utils import jclass  # noqa: E402
+from toast import toast  # noqa: E402
 
 
 def find_free_port():
@@ -83,139 +87,100 @@ BoxLayout:
             on_release: app.quit_all()
 '''
 
-Builder.load_string('''
-#:import RV RV.RV
-<MyPopup>:
-    auto_dismiss: True
-    BoxLayout:
-        orientation: 'vertical'
-        RV:
-            id: idrv
-            size_hint: (1, .7)
-        Button:
-            id: okbtn
-            text: 'Go'
-            on_release: root.go()
-            size_hint: (1, .15)
-        Button:
-            id: exitbtn
-            text: 'Exit'
-            on_release: root.dismiss()
-            size_hint: (1, .15)
-''')
-
 ACTION_RESULT_SH = 'kyvidevdl.result.sh'
+# Seconds between two compactions of the generated icon cache
+ICON_COMPACT_INTERVAL = 600
+# When set the app exits once started: see tools/startup_check.py
+STARTUP_CHECK_ENV = 'DEVICEDL_STARTUP_CHECK'
+# Seconds the exit waits for the service to acknowledge quit: a lost
+# message is sent again after ipc.ACK_TIMEOUT
+QUIT_ACK_TIMEOUT = 1.5
 
 
-class MyPopup(Popup):
+class RowBatcher(object):
+    """
+    Collects the rows built by process_devices and sends them in batches
+    of at most size rows, or older than interval seconds, so that the popup
+    can be opened at the first match.
+    """
 
-    def __init__(self, *args, **kwargs):
-        self.register_event_type('on_go')
-        super(MyPopup, self).__init__(*args, **kwargs)
+    def __init__(self, send, size=16, interval=0.1):
+        self.send = send
+        self.size = size
+        self.interval = interval
+        self.title = ''
+        self.count = 0
+        self.rows = []
+        self.last = time.perf_counter()
 
-    def on_go(self, urls, device_info):
-        pass
+    def append(self, row):
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= self.size or time.perf_counter() - self.last >= self.interval:
+            self.flush()
 
-    def go(self):
-        Logger.info("outlist = " + str(self.ids.idrv.data))
-        urls = []
-        device = dict()
-        for sh in self.ids.idrv.data:
-            if sh["sel"]:
-                device = dict(name=sh['dname'], name2=sh['dname2'], type=sh['dtype'])
-                lnk = f'udp://{sh["host"]}:{sh["udpport"]}/{quote(sh["msg"])}'
-                urls.append(dict(
-                    name=sh['name'],
-                    img=sh['ico'],
-                    link=lnk
-                ))
-        self.dismiss()
-        self.dispatch('on_go', urls, device)
-
-    def open(self, data, *args, **kwargs):
-        self.ids.idrv.data = data
-        super(MyPopup, self).open(*args, **kwargs)
+    def flush(self):
+        if self.rows:
+            self.send(self.title, self.rows)
+            self.rows = []
+        self.last = time.perf_counter()
 
 
 class MyApp(App):
 
     def on_popup_dismiss(self, *args, **kwargs):
+        from RV import icon_textures
         self.popup = None
-
-    def on_go(self, inst, shs, device_info):
-        device = self.config.get("device", "device")
-        shtemp = self.config.get("device", "shname")
-        parts = device.split('/')
-        shtemp = shtemp.replace('$p0$', parts[0])
-        shtemp = shtemp.replace('$p1$', parts[1] if len(parts) > 1 else '')
-        shtemp = shtemp.replace('  ', ' ').replace('__', '_').replace(' - - ', ' - ')
+        icon_textures.clear()
+
+    def on_go(self, inst, shs, device_info, network_info, device):
+        asyncio.ensure_future(self.put_shortcuts(shs, device_info, network_info, device))
+
+    def on_send(self, inst, commands):
+        self.update_command_gap()
+        asyncio.ensure_future(self.commands.send_sequence(
+            commands, self.config.getint('network', 'seqms') / 1000))
+
+    def send_command(self, sh):
+        self.update_command_gap()
+        fut = self.commands.send(sh['host'], sh['udpport'], sh['msg'])
+        fut.add_done_callback(partial(self.on_command_sent, sh))
+        return fut
+
+    def on_command_sent(self, sh, fut):
+        if fut.cancelled():
+            return
+        if fut.exception():
+            toast(f"Cannot send {sh['name']}: {fut.exception()!r}")
+        elif not fut.result():
+            toast(f"Too many commands: {sh['name']} not sent")
+
+    def update_command_gap(self):
+        self.commands.gap = self.config.getint('network', 'cmdgapms') / 1000
+
+    async def put_shortcuts(self, shs, device_info, network_info, device):
+        # Launcher and export get icons of the size they show
+        size = EXPORT_SIZE if platform == 'win' else launcher_size(Metrics.density)
+        imgs = await asyncio.get_event_loop().run_in_executor(
+            None, self.icon_variants.get_all, [sh['img'] for sh in shs], size)
+        for sh, img in zip(shs, imgs):
+            sh['img'] = img
+        shtemp = shortcut_template(self.config.get("device", "shname"), device)
         if platform == 'win':
-            outjson = {
-                "categories": [
-                    {
-                        "id": "fdeb3bb8-ae8e-4660-99c5-42420d142580",
-                        "name": "Scorciatoie",
-                        "shortcuts": [],
-                    }
-                ],
-                "version": 40
-            }
-            urls = outjson['categories'][0]['shortcuts']
-            try:
-                os.mkdir('outimages')
-            except OSError:
-                pass
-            for sh in shs:
-                imfn = join('outimages', str(uuid.uuid4()) + '.png')
-                shutil.copy2(sh['img'], imfn)
-                url = dict(
-                    id=str(uuid.uuid4()),
-                    iconName=f'outimages/{ntpath.basename(imfn)}',
-                    name=sh['name'],
-                    executionType="scripting",
-                    description=shtemp.replace('$sh$', sh['name']),
-                    codeOnPrepare='sendIntent({"action":"android.intent.action.SENDTO","type":"activity","dataUri":"%s"});' % sh['link']
-                )
-                urls.append(url)
-            if len(urls):
-                with open(device.replace('/', ' - ') + ' - sh.json', 'w') as outfile:
-                    outfile.write(json.dumps(outjson, indent=4))
-        else:
-            send_message(
-                '/request',
-                (json.dumps(dict(
-                    shs=shs,
-                    sh_device=device.replace('/', ' - ') + ' - ',
-                    sh_temp=shtemp,
-                    device_info=device_info,
-                    network_info=dict(
-                        host=self.config.get('network', 'host'),
-                        tcpport=int(self.config.get('network', 'tcpport')),
-                        udpport=int(self.config.get('network', 'udpport'))
-                    )
-                )),),
-                '127.0.0.1',
-                self.port_osc_service,
-                encoding='utf8'
-            )
-
-    @staticmethod
-    def init_map():
-        if platform == "android":
-            Color = autoclass("android.graphics.Color")
-            MyApp.COLOR_MAP = {
-                "Green": Color.GREEN,
-                "Red": Color.RED,
-                "Yellow": Color.YELLOW,
-                "Blue": Color.BLUE,
-                "Magenta": Color.MAGENTA}
+            bundle = self.config.get("device", "bundle")
+            path = bundle or export_filename(device)
+            # One export at a time: exports of many devices may share the bundle
+            await asyncio.get_event_loop().run_in_executor(
+                self.export_executor,
+                partial(export_shortcuts, path, shs, shtemp, device=device if bundle else None))
         else:
-            MyApp.COLOR_MAP = {
-                "Green": (0, 255, 0),
-                "Red": (255, 0, 0),
-                "Yellow": (240, 255, 0),
-                "Blue": (0, 0, 255),
-                "Magenta": (255, 0, 255)}
+            self.ipc.send_message('request', dict(
+                shs=shs,
+                sh_device=device.replace('/', ' - ') + ' - ',
+                sh_temp=shtemp,
+                device_info=device_info,
+                network_info=network_info
+            ))
 
     def build(self):
         """
@@ -224,26 +189,34 @@ class MyApp(App):
         # The line below is optional. You could leave it out or use one of the
         # standard options, such as SettingsWithSidebar, SettingsWithSpinner
         # etc.
-        self.settings_cls = SettingsWithTabbedPanel
+        # A name: the Factory imports the class when the settings are first opened
+        self.settings_cls = 'SettingsWithTabbedPanel'
 
         # We apply the saved configuration settings or the defaults
         root = Builder.load_string(kv)
-        icpth = self.default_icon_path()
-        if icpth:
-            self.config.set("graphics", "icons", icpth)
-        self.port_osc = find_free_port()
-        if platform == 'android':
-            self.port_osc_service = find_free_port()
-        self.osc = OSCThreadServer(encoding='utf8')
-        self.osc.listen(address='127.0.0.1', port=self.port_osc, default=True)
-        self.osc.bind('/dl_finish', self.dl_process)
-        self.osc.bind('/sh_put', self.on_sh_put)
+        # OSC server and icon path are set up by late_start
+        self.ipc = None
         self.popup = None
+        self.icon_index = IconIndex()
+        self.icon_cache = IconCache(RENDER_VERSION)
+        self.render_queue = RenderQueue(on_written=self.icon_cache.add)
+        self.icon_variants = IconVariants(self.icon_cache)
+        self.shortcuts = ShortcutBuilder(self.icon_index, self.icon_cache, self.render_queue,
+                                         on_icons=partial(self.to_ui, self.dl_icons))
+        Clock.schedule_interval(self.compact_icons, ICON_COMPACT_INTERVAL)
+        self.dl_task = None
+        self.dl_shown = False
+        self.dl_buffer = []
+        self.dl_icons_done = set()
+        self.dl_started = 0
+        self.dl_metrics = dict()
+        self.hubs = dict()
+        self.commands = CommandDispatcher()
+        self.export_executor = ThreadPoolExecutor(1)
         return root
 
-    def on_sh_put(self, msg):
-        Logger.info(f'Processed received {msg}')
-        m = json.loads(msg)
+    def on_sh_put(self, m):
+        Logger.info(f'Processed received {m}')
         if m:
             toast(f"Shortucut {m['name']} placed")
         else:
@@ -257,29 +230,50 @@ class MyApp(App):
                 self.quit_all()
 
     def quit_all(self):
-        if platform == "android":
-            send_message(
-                '/quit',
-                (1,),
-                '127.0.0.1',
-                self.port_osc_service,
-                encoding='utf8'
-            )
+        if self.ipc:
+            self.ipc.send_message('quit', 1)
+            # Sent again if lost: wait for the ack of the service
+            self.ipc.close(QUIT_ACK_TIMEOUT)
         self.stop()
 
     def on_start(self):
         Logger.info(f"config file is {self.get_application_config()}")
+        # After the first frame: what is not needed to show it is done later
+        Clock.schedule_once(self.late_start)
+
+    def late_start(self, *args):
+        self.startup_time = time.perf_counter() - _IMPORT_STARTED
+        Logger.info(f"Startup: interactive in {self.startup_time * 1000:.0f} ms")
+        if os.environ.get(STARTUP_CHECK_ENV):
+            print(f"STARTUP interactive_ms={self.startup_time * 1000:.0f}", flush=True)
+            self.stop()
+            return
+        icpth = self.default_icon_path()
+        if icpth:
+            self.config.set("graphics", "icons", icpth)
         if platform == "android":
+            from android.permissions import request_permissions, Permission
             from kivy.core.window import Window
-            from jnius import autoclass
+            from oscpy.server import OSCThreadServer
+            request_permissions([Permission.INTERNET, Permission.READ_EXTERNAL_STORAGE,
+                                 Permission.WRITE_EXTERNAL_STORAGE])
             Window.bind(on_keyboard=self.on_keyboard)
+            # OSC is only used to talk with ShortcutService
+            self.port_osc = find_free_port()
+            self.port_osc_service = find_free_port()
+            self.osc = OSCThreadServer(encoding='utf8')
+            self.osc.listen(address='127.0.0.1', port=self.port_osc, default=True)
+            self.ipc = bind_osc(self.osc, self.port_osc_service,
+                                dict(sh_put=partial(self.to_ui, self.on_sh_put)),
+                                spool_dir=self.user_data_dir)
             package_name = 'org.kivymfz.devicedl'
             service_name = 'ShortcutService'
             service_class = '{}.Service{}'.format(package_name, service_name.title())
-            service = autoclass(service_class)
-            mActivity = autoclass('org.kivy.android.PythonActivity').mActivity
+            service = jclass(service_class)
+            mActivity = jclass('org.kivy.android.PythonActivity').mActivity
             arg = dict(port_to_bind=self.port_osc_service,
-                       port_to_send=self.port_osc)
+                       port_to_send=self.port_osc,
+                       spool_dir=self.user_data_dir)
             argument = json.dumps(arg)
             Logger.info("Starting %s [%s]" % (service_class, argument))
             service.start(mActivity, argument)
@@ -292,8 +286,8 @@ class MyApp(App):
             traceback.print_exc()
         if not icpth or not os.path.isdir(icpth):
             if platform == "android":
-                Environment = autoclass('android.os.Environment')
-                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                Environment = jclass('android.os.Environment')
+                PythonActivity = jclass('org.kivy.android.PythonActivity')
                 icpth2 = PythonActivity.mActivity.getExternalFilesDir(
                     Environment.DIRECTORY_PICTURES).getAbsolutePath()
             else:
@@ -306,30 +300,97 @@ class MyApp(App):
         """
         Set the default values for the configs sections.
         """
-        config.setdefaults('network', {'host': '192.168.1.1', 'tcpport': 10001, 'udpport': 10000, 'mqttport': 8913})
-        config.setdefaults('device', {'device': '', 'shname': '$p0$_$p1$_$sh$'})
+        config.setdefaults('network', {'host': '192.168.1.1', 'tcpport': 10001, 'udpport': 10000, 'mqttport': 8913,
+                                       'maxdlkb': 32768, 'hubs': '', 'deadline': 30,
+                                       'cmdgapms': 100, 'seqms': 500})
+        config.setdefaults('device', {'device': '', 'shname': '$p0$_$p1$_$sh$', 'bundle': ''})
         config.setdefaults('params', {'home': 'Home'})
-        icpth = self.default_icon_path()
-        if icpth:
-            config.setdefaults('graphics', {'icons': icpth, 'color': 'Magenta'})
-
-    def dl_process(self, msg):
-        m = json.loads(msg)
-        if 'error' in msg:
+        # An invalid icons path is replaced by the default one in late_start
+        config.setdefaults('graphics', {'cachemb': 20, 'icons': '', 'color': 'Magenta'})
+
+    def to_ui(self, func, *args):
+        # Results of worker threads are handed to the UI thread as they are
+        Clock.schedule_once(lambda dt: func(*args))
+
+    def dl_rows(self, update, title, rows):
+        self.resolve_icons(rows)
+        if update:
+            # Rows of a revalidation are applied all together when it ends
+            self.dl_buffer.extend(rows)
+        elif self.popup:
+            self.popup.append(rows)
+        elif not self.dl_shown:
+            self.dl_open(title, rows)
+
+    def dl_icons(self, done):
+        self.dl_icons_done.update(done)
+        if self.popup:
+            if self.resolve_icons(self.popup.ids.idrv.data, done):
+                self.popup.ids.idrv.refresh_from_data()
+
+    def resolve_icons(self, rows, done=None):
+        done = self.dl_icons_done if done is None else done
+        if isinstance(rows, RowStore):
+            return rows.resolve_pending(done)
+        changed = False
+        for sh in rows:
+            if sh['ico_pending'] and sh['ico_pending'] in done:
+                sh['ico'] = sh['ico_pending']
+                sh['ico_pending'] = ''
+                changed = True
+        return changed
+
+    def dl_open(self, title, rows):
+        from popup import MyPopup
+        from RV import icon_textures
+        icon_textures.variants = self.icon_variants
+        self.dl_shown = True
+        self.dl_metrics['ttfr'] = time.perf_counter() - self.dl_started
+        Logger.info(f"Time to first row: {self.dl_metrics['ttfr'] * 1000:.0f} ms")
+        self.popup = MyPopup(title=title, on_go=self.on_go, on_send=self.on_send, on_dismiss=self.on_popup_dismiss)
+        self.popup.open(rows)
+
+    def dl_process(self, m):
+        if 'error' in m:
             toast("Error in dl: " + m['error'])
-        elif 'obj' in msg:
-            Logger.debug(m['obj'])
-            if len(m['obj']) and len(m['title']):
-                self.popup = MyPopup(title=m['title'], on_go=self.on_go, on_dismiss=self.on_popup_dismiss)
-                self.popup.open(m['obj'])
-            else:
-                toast("\n".join(
-                      textwrap.wrap(
-                          "No matching devices found (" + self.config.get("device", "device") + "). Available filters: " + str(m['filters']), width=60)),
-                      True)
-
+        elif m['update']:
+            rows = self.dl_buffer
+            self.dl_buffer = []
+            self.resolve_icons(rows)
+            if self.popup:
+                self.dl_update(rows, m['title'])
+            elif not self.dl_shown:
+                if rows:
+                    self.dl_open(m['title'], rows)
+                else:
+                    self.dl_nomatch(m['filters'])
+        elif not m['nrows']:
+            self.dl_nomatch(m['filters'])
+        self.dl_metrics['total'] = time.perf_counter() - self.dl_started
+        Logger.info(f"Download metrics: {self.dl_metrics}")
         self.root.ids.okbtn.disabled = False
 
+    def dl_nomatch(self, filters):
+        toast("\n".join(
+              textwrap.wrap(
+                  "No matching devices found (" + self.config.get("device", "device") + "). Available filters: " + str(filters), width=60)),
+              True)
+
+    def dl_update(self, rows, title):
+        # The hub answered with something different from the snapshot
+        if not len(rows):
+            self.popup.dismiss()
+            toast("Device list changed: no matching devices found")
+            return
+        store = self.popup.ids.idrv.data
+        oldsel = {store.msg[i] for i in store.selected_indices()}
+        for sh in rows:
+            sh['sel'] = sh['msg'] in oldsel
+        self.popup.title = title
+        self.popup.ids.idrv.data = rows
+        self.popup.search(self.popup.ids.search.text)
+        toast("Device list updated")
+
     def build_settings(self, settings):
         """
         Add our custom section to the default configuration object.
@@ -354,180 +415,21 @@ class MyApp(App):
         Logger.info("main.py: App.close_settings: {0}".format(settings))
         super(MyApp, self).close_settings(settings)
 
-    def alter_server_obj(self, o):
-        devices = []
-        devs = o["action"]["hosts"]
-        for _, d in devs.items():
-            if 'sh' in d:
-                ll = dict()
-                for k in d['sh']:
-                    sh = k.split(':')[0]
-                    ll[sh + ':1'] = 1
-                d['sh'] = list(ll.keys())
-            if 'dir' in d:
-                ll = list()
-                for k in d['dir']:
-                    sh = k.split(':')
-                    ll.append(sh[0] + ':' + sh[1] + ':1')
-                d['dir'] = ll
-            devices.append(d)
-        return devices
-
     def log(self, m):
         print(m)
 
 # https://stackoverflow.com/questions/45830039/kivy-python-multiple-widgets-in-recycleview-row
 
-    def define_sh(self, dev, shnm, msg):
-        mo = re.search("^@[a-z]_([0-9]+)_(.*)", shnm)
-        if mo:
-            shnm = "@" + mo.group(1) + "_" + mo.group(2)
-        fico = self.config.get("graphics", "icons") + '/'
-        generated = fico + "generated/"
-        try:
-            os.mkdir(generated)
-        except Exception:
-            pass
-        tp = dev["type"][6:].lower()
-        Logger.debug("TP = " + tp)
-        col = self.config.get("graphics", "color")
-        fom = ""
-        try:
-            if tp == "rm" or tp == "allone" or tp == "ct10" or\
-                    tp == "upnpirta2" or tp == "upnpirrc" or tp == "samsungctl":
-                if shnm[0] == "@":
-                    shnm = shnm[1:]
-                mo = re.search("^([^0-9]+)[0-9]+([\\-\\+])$", shnm)
-                if mo:
-                    iconm = mo.group(1) + mo.group(2)
-                else:
-                    iconm = shnm
-                iconm = iconm.lower()
-                Logger.debug("Searching " + dev["name"] + ":" + shnm)
-                fom1 = fico + iconm + "_ac.png"
-                fom2 = fico + iconm + ".png"
-                fom3 = generated + iconm + "_" + col + ".png"
-                fim = fico + tp + ".png"
-                if not os.path.isfile(fom1) and not os.path.isfile(fom2):
-                    Logger.debug("Not found " + dev["name"] + ":" + iconm)
-                    mo = re.search("^([0-9]+)_", iconm)
-
-                    if mo:
-                        nums = mo.group(1)
-                        fom = generated + nums + "_" + col + ".png"
-                        Logger.debug("Creating " + fom)
-                        self.createImageText(nums, MyApp.COLOR_MAP[col], fom)
-                    elif os.path.isfile(fim):
-                        fom = generated + tp + "_" + col + ".png"
-                        Logger.debug("Creating " + fom)
-                        self.changeImageColor(fim, MyApp.COLOR_MAP[col], fom)
-                elif os.path.isfile(fom1):
-                    fom = fom1
-                elif os.path.isfile(fom3):
-                    fom = fom3
-                else:
-                    fom = fom3
-                    Logger.debug("Creating " + fom)
-                    self.changeImageColor(fom2, MyApp.COLOR_MAP[col], fom)
-            elif tp == "s20" or tp == "tasmotaswitch" or (tp == "primelan" and (dev["subtype"] == 2 or dev["subtype"] == 0)):
-                col = "Green" if shnm == "ON" else "Red"
-                fim = fico + tp + ".png"
-                fom = generated + tp + "_" + col + ".png"
-                Logger.debug("Creating " + fom)
-                self.changeImageColor(fim, MyApp.COLOR_MAP[col], fom)
-            elif tp == "virtual" or (tp == "primelan" and dev["subtype"] == 1):
-                fom = generated + shnm + "_" + col + ".png"
-                Logger.debug("Creating " + fom)
-                self.createImageText(shnm, MyApp.COLOR_MAP[col], fom)
-        except Exception:
-            fom = ""
-            traceback.print_exc()
-        return dict(ico=fico + 'default.png' if not len(fom) or not os.path.isfile(fom) else fom,
-                    dname=dev["name"], dname2=dev["name2"], name=shnm, msg=msg, sel=False,
-                    dtype=dev["type"], host=self.config.get('network', 'host'),
-                    udpport=int(self.config.get('network', 'udpport')))
-
-    def createImageText(self, txt, col, fom):
-        if not os.path.isfile(fom):
-            if platform == "android":
-                FileOutputStream = autoclass("java.io.FileOutputStream")
-                Bitmap = autoclass("android.graphics.Bitmap")
-                BitmapConfig = autoclass("android.graphics.Bitmap$Config")
-                BitmapCompressFormat = autoclass("android.graphics.Bitmap$CompressFormat")
-                Canvas = autoclass("android.graphics.Canvas")
-                # PorterDuff = autoclass("android.graphics.PorterDuff")
-                PorterDuffMode = autoclass("android.graphics.PorterDuff$Mode")
-                Paint = autoclass("android.graphics.Paint")
-                PaintAlign = autoclass("android.graphics.Paint$Align")
-                Color = autoclass("android.graphics.Color")
-                paint = Paint(Paint.ANTI_ALIAS_FLAG)
-                paint.setTextSize(55)
-                paint.setColor(col)
-                paint.setTextAlign(PaintAlign.LEFT)
-                baseline = -paint.ascent()  # ascent() is negative
-                width = round(paint.measureText(txt))  # round
-                height = round(baseline + paint.descent())
-                image = Bitmap.createBitmap(width, height, BitmapConfig.ARGB_8888)
-                canvas = Canvas(image)
-                canvas.drawColor(Color.TRANSPARENT, PorterDuffMode.CLEAR)
-                canvas.drawText(txt, 0, baseline, paint)
-                image.compress(BitmapCompressFormat.PNG, 100, FileOutputStream(fom))
-            else:
-                from PIL import Image, ImageDraw, ImageFont
-                img = Image.new('RGBA', (128, 128), (255, 0, 0, 0))
-
-                d = ImageDraw.Draw(img)
-                fnt = ImageFont.truetype("arial", 50)
-                d.text((18, 18), txt, fill=col, font=fnt)
-
-                img.save(fom)
-
-    def changeImageColor(self, fim, col, fom):
-        if not os.path.isfile(fom):
-            if platform == "android":
-                FileOutputStream = autoclass("java.io.FileOutputStream")
-                BitmapFactory = autoclass("android.graphics.BitmapFactory")
-                BitmapFactoryOptions = autoclass("android.graphics.BitmapFactory$Options")
-                # BitmapConfig = autoclass("android.graphics.Bitmap$Config")
-                BitmapCompressFormat = autoclass("android.graphics.Bitmap$CompressFormat")
-                Canvas = autoclass("android.graphics.Canvas")
-                PorterDuffMode = autoclass("android.graphics.PorterDuff$Mode")
-                Paint = autoclass("android.graphics.Paint")
-                PorterDuffColorFilter = autoclass("android.graphics.PorterDuffColorFilter")
-                options = BitmapFactoryOptions()
-                options.inMutable = True
-                # declaredField = options.getClass().getDeclaredField("inPreferredConfig")
-                # declaredField.set(cast('java.lang.Object',options), cast('java.lang.Object', BitmapConfig.ARGB_8888))
-                # options.inPreferredConfig = BitmapConfig.ARGB_8888;
-                bm = BitmapFactory.decodeFile(fim, options)
-                paint = Paint()
-                filterv = PorterDuffColorFilter(col, PorterDuffMode.SRC_IN)
-                paint.setColorFilter(filterv)
-                canvas = Canvas(bm)
-                canvas.drawBitmap(bm, 0, 0, paint)
-                bm.compress(BitmapCompressFormat.PNG, 100, FileOutputStream(fom))
-            else:
-                from PIL import Image
-                import numpy as np
-                im = Image.open(fim)
-                im = im.convert('RGBA')
-                np.array(im)
-                data = np.array(im)   # "data" is a height x width x 4 numpy array
-                red, green, blue, alpha = data.T  # Temporarily unpack the bands for readability
-
-                # Replace white with red... (leaves alpha values alone...)
-                white_areas = (red == 255) & (blue == 255) & (green == 255)
-                data[..., :-1][white_areas.T] = col  # Transpose back needed
-
-                im2 = Image.fromarray(data)
-                im2.save(fom)
+    def compact_icons(self, *args):
+        keep = set(self.popup.ids.idrv.data.ico) if self.popup else set()
+        asyncio.get_event_loop().run_in_executor(None, self.icon_cache.compact, keep, self.render_queue)
 
     def _get_user_data_dir(self):
         # Determine and return the user_data_dir.
         if platform == 'android':
-            from jnius import autoclass, cast
-            Environment = autoclass('android.os.Environment')
-            PythonActivity = autoclass('org.kivy.android.PythonActivity')
+            from jnius import cast
+            Environment = jclass('android.os.Environment')
+            PythonActivity = jclass('org.kivy.android.PythonActivity')
             ctx = PythonActivity.mActivity
             strg = ctx.getExternalFilesDirs(None)
             if strg:
@@ -544,158 +446,106 @@ class MyApp(App):
                 os.mkdir(data_dir)
             return data_dir
         else:
-            super(MyApp, self)._get_user_data_dir()
-
-    def dl_devices(self, *args):
-
-        # Connect the socket to the port where the server is listening
-        stringall = b''
-        obj = None
-        for _ in range(3):
-            lastex = None
-            sock = None
-            stringall = b''
-            obj = None
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                # sock.settimeout(self.timeout)
-                sock.connect((self.config.get('network', 'host'),
-                              int(self.config.get('network', 'tcpport'))))
-                sock.setblocking(0)
-                sock.settimeout(5000)
-                sock.send(b"@7 devicedl\n")
-                now = time.time()
-                idx = -1
-                while time.time() - now < 10:
-                    ready = select.select([sock], [sock], [], 0.5)
-                    if ready[0]:
-                        data = sock.recv(4096)
-                        if not data:
-                            raise Exception('Conection closed')
-                        else:
-                            Logger.debug("RCV: " + str(data))
-                            idx = data.find(10)
-                            if idx < 0:
-                                stringall += data
-                            else:
-                                stringall += data[0:idx]
-                                break
-                if idx < 0:
-                    raise Exception('Timeout in receiving data')
-                sock.close()
-                obj = json.loads(stringall)
-                obj = self.alter_server_obj(obj)
-                break
-            except Exception:
-                lastex = traceback.format_exc()
-                if sock:
+            return super(MyApp, self)._get_user_data_dir()
+
+    def snapshot_path(self, hub):
+        return snapshot_path(self.user_data_dir, hub.host, hub.tcpport)
+
+    def get_hubs(self):
+        return parse_hubs(self.config.get('network', 'host'),
+                          self.config.get('network', 'tcpport'),
+                          self.config.get('network', 'udpport'),
+                          self.config.get('network', 'hubs'))
+
+    async def dl_hub(self, hub, received):
+        def progress(nbytes):
+            received[hub.name] = nbytes
+            self.dl_progress(sum(received.values()))
+        return await fetch_devices(self.get_hub(hub),
+                                   float(self.config.get('network', 'deadline')),
+                                   int(self.config.get('network', 'maxdlkb')) * 1024,
+                                   progress=progress)
+
+    async def dl_devices(self):
+        loop = asyncio.get_event_loop()
+        try:
+            hubs = self.get_hubs()
+        except Exception as ex:
+            # A malformed "Other hosts" setting
+            self.root.ids.okbtn.text = 'Go'
+            self.send_error(f'Invalid hubs: {ex!r}')
+            return
+        self.close_hubs(keep=hubs)
+        snpaths = [self.snapshot_path(hub) for hub in hubs]
+        cached = await asyncio.gather(*[loop.run_in_executor(None, load_snapshot, p) for p in snpaths])
+        if any(cached):
+            Logger.info(f"Using device snapshots of {[time.ctime(c.created) for c in cached if c]}")
+            await loop.run_in_executor(None, self.process_devices,
+                                       DeviceCatalog(hubs, [c.devices if c else [] for c in cached]))
+        # All the hubs are queried together: the slowest one sets the total time
+        try:
+            results = await asyncio.gather(*[self.dl_hub(hub, dict()) for hub in hubs], return_exceptions=True)
+        except asyncio.CancelledError:
+            Logger.info("Device download cancelled")
+            raise
+        finally:
+            self.root.ids.okbtn.text = 'Go'
+        devlists = []
+        errors = []
+        changed = False
+        for hub, snpath, snap, res in zip(hubs, snpaths, cached, results):
+            if isinstance(res, BaseException):
+                Logger.error(f"Download from {hub} failed: {res!r}")
+                errors.append(f'{hub}: {res!r}')
+                devlists.append(snap.devices if snap else [])
+            else:
+                devlists.append(res)
+                if not snap or snap.digest != snapshot_digest(res):
+                    changed = True
                     try:
-                        sock.close()
+                        await loop.run_in_executor(None, save_snapshot, snpath, res)
                     except Exception:
-                        pass
-                traceback.print_exc()
+                        traceback.print_exc()
+        if errors:
+            if len(errors) == len(hubs) and not any(cached):
+                self.send_error("\n".join(errors))
+                return
+            toast("Unreachable: " + ", ".join(hub.name for hub, res in zip(hubs, results)
+                                              if isinstance(res, BaseException)) + ". Using saved device list")
+        if not changed and any(cached):
+            Logger.info("Device snapshots are up to date")
+            return
+        await loop.run_in_executor(None, self.process_devices, DeviceCatalog(hubs, devlists), any(cached))
+
+    def send_error(self, lastex):
+        self.to_ui(self.dl_process, dict(error=str(lastex)))
+
+    def send_rows(self, update, title, rows):
+        self.to_ui(self.dl_rows, update, title, rows)
+
+    def dl_progress(self, nbytes):
+        self.root.ids.okbtn.text = f'Go ({nbytes // 1024} KB)'
+
+    def process_devices(self, catalog, update=False):
+        lastex = None
+        try:
+            outobj = RowBatcher(partial(self.send_rows, update))
+            self.icon_index.set_path(self.config.get("graphics", "icons"))
+            self.icon_index.refresh()
+            self.icon_cache.set_path(self.icon_index.generated)
+            self.icon_cache.budget = self.config.getint("graphics", "cachemb") * 1024 * 1024
+            self.shortcuts.color = self.config.get("graphics", "color")
+            groups = catalog.resolve(split_filters(self.config.get("device", "device")))
+            title = outobj.title = ", ".join(g[0] for g in groups)
+            for group, dev, remote in groups:
+                self.shortcuts.device_shortcuts(outobj, dev, remote, group if len(groups) > 1 else '')
+            outobj.flush()
+            self.to_ui(self.dl_process, dict(nrows=outobj.count, title=title, filters=catalog.filters, update=update))
+        except Exception:
+            lastex = traceback.format_exc()
+            traceback.print_exc()
         if lastex:
-            send_message(
-                '/dl_finish',
-                (json.dumps(dict(error=str(lastex))),),
-                '127.0.0.1',
-                self.port_osc,
-                encoding='utf8'
-            )
-        else:
-            try:
-                outobj = list()
-                foundfilters = []
-                title = ''
-                devfilter = self.config.get("device", "device")
-                filters = devfilter.split('/')
-                for dev in obj:
-                    dn = dev["name"]
-                    dev['name2'] = ''
-                    dt = dev["type"]
-                    Logger.debug("DEV " + dn + ":" + dt + "/" + str(dev))
-                    k = 1
-                    filt = False
-                    if 'sh' in dev:
-                        Logger.debug("Filter detected: " + dn + "/sh")
-                        foundfilters.append(dn + '/sh')
-                        filt = True
-                    if "dir" in dev:
-                        filt2 = dict()
-                        for remk in dev["dir"]:
-                            parts = remk.split(':')
-                            remn = parts[0]
-                            if remn not in filt2:
-                                filt2[remn] = 1
-                                Logger.debug("Filter detected: " + dn + "/" + remn)
-                                foundfilters.append(dn + '/' + remn)
-                        filt = True
-                    if not filt:
-                        Logger.debug("Filter detected: " + dn)
-                        foundfilters.append(dn)
-                    if len(filters) and dn == filters[0]:
-                        title = dn
-                        if dt == "DeviceRM" or dt == "DeviceAllOne" or dt == "DeviceCT10" or\
-                                dt == "DeviceUpnpIRTA2" or dt == "DeviceUpnpIRRC" or dt == "DeviceSamsungCtl":
-                            remmap = dict()
-                            if "sh" in dev and len(filters) > 1 and filters[1] == "sh":
-                                title += '/sh'
-                                for remk in dev["sh"]:
-                                    parts = remk.split(':')
-                                    shnm = parts[0]
-                                    if shnm not in remmap:
-                                        remmap[shnm] = 1
-                                        outobj.append(self.define_sh(
-                                            dev, shnm, "@" + str(k) + " emitir " + dn + " " + shnm))
-                                        k += 1
-                            elif "dir" in dev and len(filters) > 1:
-                                title += "/" + filters[1]
-                                for remk in dev["dir"]:
-                                    parts = remk.split(':')
-                                    remn = parts[0]
-                                    shnm = parts[1]
-                                    if remn == filters[1] and shnm not in remmap:
-                                        remmap[shnm] = 1
-                                        dev['name2'] = remn
-                                        outobj.append(self.define_sh(
-                                            dev, shnm, "@" + str(k) + " emitir " + dn + " " + remn + ":" + shnm))
-                                        k += 1
-                        elif dt == "DeviceVirtual":
-                            for stvalue, shnm in dev['nicks'].items():
-                                outobj.append(self.define_sh(dev, shnm, "@" + str(k) +
-                                                             " statechange " + dn + " " + stvalue))
-                                k += 1
-                        elif dt == "DevicePrimelan" and int(dev["subtype"]) == 1:
-                            Logger.debug("Here 1")
-                            for stvalue in range(100):
-                                outobj.append(self.define_sh(dev, str(stvalue), "@" +
-                                                             str(k) + " statechange " + dn + " " + str(stvalue)))
-                                k += 1
-                        elif dt == "DeviceS20" or dt == "DeviceTasmotaswitch" or (dt == "DevicePrimelan" and (int(dev["subtype"]) == 2 or int(dev["subtype"]) == 0)):
-                            Logger.debug("Here 2")
-                            outobj.append(self.define_sh(dev, "ON", "@" +
-                                                         str(k) + " statechange " + dn + " 1"))
-                            k += 1
-                            outobj.append(self.define_sh(dev, "OFF", "@" +
-                                                         str(k) + " statechange " + dn + " 0"))
-                send_message(
-                    '/dl_finish',
-                    (json.dumps(dict(obj=outobj, title=title, filters=foundfilters)),),
-                    '127.0.0.1',
-                    self.port_osc,
-                    encoding='utf8'
-                )
-            except Exception:
-                lastex = traceback.format_exc()
-                traceback.print_exc()
-            if lastex:
-                send_message(
-                    '/dl_finish',
-                    (json.dumps(dict(error=str(lastex))),),
-                    '127.0.0.1',
-                    self.port_osc,
-                    encoding='utf8'
-                )
+            self.send_error(lastex)
 
     def tst(self):
         self.root.ids.okbtn.disabled = True
@@ -703,32 +553,44 @@ class MyApp(App):
 
     def go(self):
         self.root.ids.okbtn.disabled = True
-        threading.Thread(target=self.dl_devices).start()
-
-
-class MySettingsWithTabbedPanel(SettingsWithTabbedPanel):
-    """
-    It is not usually necessary to create subclass of a settings panel. There
-    are many built-in types that you can use out of the box
-    (SettingsWithSidebar, SettingsWithSpinner etc.).
-    You would only want to create a Settings subclass like this if you want to
-    change the behavior or appearance of an existing Settings class.
-    """
-
-    def on_close(self):
-        Logger.info("main.py: MySettingsWithTabbedPanel.on_close")
-        App.get_running_app().stop()
-
-    def on_config_change(self, config, section, key, value):
-        Logger.info(
-            "main.py: MySettingsWithTabbedPanel.on_config_change: "
-            "{0}, {1}, {2}, {3}".format(config, section, key, value))
-
-
-MyApp.init_map()
-
-os.environ['KIVY_EVENTLOOP'] = 'async'
-loop = asyncio.get_event_loop()
-loop.run_until_complete(MyApp().async_run())
-loop.close()
-# MyApp().run()
+        self.cancel_dl()
+        self.dl_shown = False
+        self.dl_buffer = []
+        self.dl_icons_done = set()
+        self.dl_started = time.perf_counter()
+        self.dl_metrics = dict()
+        self.dl_task = asyncio.ensure_future(self.dl_devices())
+
+    def cancel_dl(self):
+        if self.dl_task and not self.dl_task.done():
+            self.dl_task.cancel()
+        self.dl_task = None
+
+    def get_hub(self, hub):
+        key = (hub.host, hub.tcpport)
+        if key not in self.hubs:
+            self.hubs[key] = HubConnection(hub.host, hub.tcpport)
+        return self.hubs[key]
+
+    def close_hubs(self, keep=()):
+        keep = {(hub.host, hub.tcpport) for hub in keep}
+        for key in list(self.hubs.keys()):
+            if key not in keep:
+                self.hubs.pop(key).close()
+
+    def on_stop(self):
+        self.cancel_dl()
+        self.close_hubs()
+        self.render_queue.shutdown()
+        self.commands.close()
+        Logger.info(f'Commands: latency {self.commands.latency}')
+        self.icon_cache.save()
+
+
+# Guarded: icon render processes import this module again
+if __name__ == '__main__':
+    os.environ['KIVY_EVENTLOOP'] = 'async'
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(MyApp().async_run())
+    loop.close()
+    # MyApp().run()
@@ -0,0 +1,115 @@
+"""
+Shortcut list popup, imported when the first download shows it: its
+KV rules and the RecycleView classes are not loaded at startup.
+"""
+from kivy.lang import Builder
+from kivy.logger import Logger
+from kivy.uix.popup import Popup
+
+from devicedl.export import group_shortcuts
+from devicedl.rows import Row
+
+Builder.load_string('''
+#:import RV RV.RV
+<MyPopup>:
+    auto_dismiss: True
+    BoxLayout:
+        orientation: 'vertical'
+        BoxLayout:
+            size_hint: (1, .1)
+            TextInput:
+                id: search
+                hint_text: 'Search'
+                multiline: False
+                size_hint_x: .55
+                on_text: root.search(self.text)
+            Button:
+                text: 'All'
+                size_hint_x: .15
+                on_release: root.select_all()
+            Button:
+                text: 'None'
+                size_hint_x: .15
+                on_release: root.select_none()
+            Button:
+                text: 'Matching'
+                size_hint_x: .15
+                on_release: root.select_matching()
+        RV:
+            id: idrv
+            size_hint: (1, .6)
+        BoxLayout:
+            size_hint: (1, .15)
+            Button:
+                id: okbtn
+                text: 'Go'
+                on_release: root.go()
+            Button:
+                id: sendbtn
+                text: 'Send selected'
+                on_release: root.send_selected()
+        Button:
+            id: exitbtn
+            text: 'Exit'
+            on_release: root.dismiss()
+            size_hint: (1, .15)
+''')
+
+
+class MyPopup(Popup):
+
+    def __init__(self, *args, **kwargs):
+        self.register_event_type('on_go')
+        self.register_event_type('on_send')
+        super(MyPopup, self).__init__(*args, **kwargs)
+
+    def on_go(self, urls, device_info, network_info, filt):
+        pass
+
+    def on_send(self, commands):
+        pass
+
+    def send_selected(self):
+        store = self.ids.idrv.data
+        commands = []
+        for i in store.selected_indices():
+            sh = Row(store, i)
+            commands.append((sh['host'], sh['udpport'], sh['msg']))
+        if commands:
+            self.dispatch('on_send', commands)
+
+    def go(self):
+        store = self.ids.idrv.data
+        Logger.info(f"outlist = {len(store)} rows")
+        groups = group_shortcuts(Row(store, i) for i in store.selected_indices())
+        self.dismiss()
+        for filt, (urls, device, network) in groups.items():
+            self.dispatch('on_go', urls, device, network, filt)
+
+    def open(self, data, *args, **kwargs):
+        self.ids.idrv.data = data
+        super(MyPopup, self).open(*args, **kwargs)
+
+    def append(self, data):
+        self.ids.idrv.extend(data)
+        if self.ids.search.text:
+            self.search(self.ids.search.text)
+
+    def search(self, text):
+        store = self.ids.idrv.data
+        store.set_filter(store.search(text) if text else None)
+        self.ids.idrv.refresh_from_data()
+
+    def select_all(self):
+        self.ids.idrv.data.select_all()
+        self.ids.idrv.refresh_from_data()
+
+    def select_none(self):
+        self.ids.idrv.data.select_none()
+        self.ids.idrv.refresh_from_data()
+
+    def select_matching(self):
+        store = self.ids.idrv.data
+        if self.ids.search.text:
+            store.select_many(store.search(self.ids.search.text))
+            self.ids.idrv.refresh_from_data()
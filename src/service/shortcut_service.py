@@ -1,17 +1,22 @@
 import asyncio
 import json
+import logging
 import os
+import sys
 import threading
 import traceback
 from functools import partial
 from os.path import dirname, join
-from time import time
+from time import perf_counter, time
 
-from android.broadcast import BroadcastReceiver
-from jnius import PythonJavaClass, autoclass, cast, java_method
-from kivy.logger import Logger
-from oscpy.client import send_message
-from oscpy.server import OSCThreadServer
+_IMPORT_STARTED = perf_counter()
+
+from android.broadcast import BroadcastReceiver  # noqa: E402
+from jnius import PythonJavaClass, cast, java_method  # noqa: E402
+from oscpy.server import OSCThreadServer  # noqa: E402
+
+from devicedl.ipc import bind_osc  # noqa: E402
+from devicedl.utils import Logger, jclass  # noqa: E402
 
 ACTION_RESULT_SH = 'kyvidevdl.result.sh'
 ACTION_NEXT_SH = 'kyvidevdl.next.sh'
@@ -21,6 +26,8 @@ ACTION_REPEAT_SH = 'kyvidevdl.repeat.sh'
 DEVICE_EXTRA = 'kyvidevdl.device'
 NETWORK_EXTRA = 'kyvidevdl.network'
 
+IMAGES_DIR = join(dirname(__file__), '..', 'images')
+
 
 class Runnable(PythonJavaClass):
     '''Wrapper around Java Runnable class. This class can be used to schedule a
@@ -43,110 +50,102 @@ class Runnable(PythonJavaClass):
             traceback.print_exc()
 
 
+class JavaClass(object):
+    '''Class attribute resolving a Java class at its first use (once per
+    process, see jclass): the service does not pay at startup for the
+    classes used only to pin shortcuts.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        return jclass(self.name)
+
+
 class ShortcutService(object):
-    def init_java_classes(self):
-        self.PendingIntent = autoclass('android.app.PendingIntent')
-        self.PersistableBundle = autoclass('android.os.PersistableBundle')
-        self.ShortcutInfoBuilder = autoclass('android.content.pm.ShortcutInfo$Builder')
-        self.Intent = autoclass('android.content.Intent')
-        self.Icon = autoclass('android.graphics.drawable.Icon')
-        self.Uri = autoclass('android.net.Uri')
-        self.BitmapFactory = autoclass("android.graphics.BitmapFactory")
-        self.AndroidString = autoclass('java.lang.String')
-        self.LauncherApps = autoclass('android.content.pm.LauncherApps')
-        BitmapFactoryOptions = autoclass("android.graphics.BitmapFactory$Options")
-        self.bitmap_factory_options = BitmapFactoryOptions()
+    PendingIntent = JavaClass('android.app.PendingIntent')
+    PersistableBundle = JavaClass('android.os.PersistableBundle')
+    ShortcutInfoBuilder = JavaClass('android.content.pm.ShortcutInfo$Builder')
+    Intent = JavaClass('android.content.Intent')
+    Icon = JavaClass('android.graphics.drawable.Icon')
+    Uri = JavaClass('android.net.Uri')
+    BitmapFactory = JavaClass("android.graphics.BitmapFactory")
+    AndroidString = JavaClass('java.lang.String')
+    LauncherApps = JavaClass('android.content.pm.LauncherApps')
+    NotificationBuilder = JavaClass('android.app.Notification$Builder')
+    NotificationActionBuilder = JavaClass('android.app.Notification$Action$Builder')
+
+    def image_icon(self, name):
+        bm = self.BitmapFactory.decodeFile(join(IMAGES_DIR, name), self.bitmap_factory_options)
+        return self.Icon.createWithBitmap(bm)
 
     def init_notification(self):
-        self.init_java_classes()
-        Context = autoclass('android.content.Context')
-        NotificationBuilder = autoclass('android.app.Notification$Builder')
-        NotificationActionBuilder = autoclass('android.app.Notification$Action$Builder')
-        Notification = autoclass('android.app.Notification')
-        Color = autoclass("android.graphics.Color")
-        NotificationChannel = autoclass('android.app.NotificationChannel')
-        NotificationManager = autoclass('android.app.NotificationManager')
-        PythonActivity = autoclass('org.kivy.android.PythonActivity')
-        self.service = autoclass('org.kivy.android.PythonService').mService
+        Context = jclass('android.content.Context')
+        Notification = jclass('android.app.Notification')
+        Color = jclass("android.graphics.Color")
+        NotificationChannel = jclass('android.app.NotificationChannel')
+        NotificationManager = jclass('android.app.NotificationManager')
+        PythonActivity = jclass('org.kivy.android.PythonActivity')
+        self.bitmap_factory_options = jclass("android.graphics.BitmapFactory$Options")()
+        self.service = jclass('org.kivy.android.PythonService').mService
         self.FOREGROUND_NOTIFICATION_ID = 4572
         Intent = self.Intent
         channelName = self.AndroidString('DeviceManagerService'.encode('utf-8'))
-        NOTIFICATION_CHANNEL_ID = self.AndroidString(self.service.getPackageName().encode('utf-8'))
-        chan = NotificationChannel(NOTIFICATION_CHANNEL_ID, channelName, NotificationManager.IMPORTANCE_DEFAULT)
+        self.notification_channel_id = self.AndroidString(self.service.getPackageName().encode('utf-8'))
+        chan = NotificationChannel(self.notification_channel_id, channelName, NotificationManager.IMPORTANCE_DEFAULT)
         chan.setLightColor(Color.BLUE)
         chan.setLockscreenVisibility(Notification.VISIBILITY_PRIVATE)
         self.shortcut_service = self.service.getSystemService(Context.SHORTCUT_SERVICE)
         self.notification_service = self.service.getSystemService(Context.NOTIFICATION_SERVICE)
         app_context = self.service.getApplication().getApplicationContext()
         self.notification_service.createNotificationChannel(chan)
-        notification_image = join(dirname(__file__), '..', 'images', 'shortcut_service.png')
-        bm = self.BitmapFactory.decodeFile(notification_image, self.bitmap_factory_options)
-        notification_icon = self.Icon.createWithBitmap(bm)
+        notification_icon = self.image_icon('shortcut_service.png')
         notification_intent = Intent(app_context, PythonActivity)
         notification_intent.setFlags(Intent.FLAG_ACTIVITY_CLEAR_TOP |
                                      Intent.FLAG_ACTIVITY_SINGLE_TOP |
                                      Intent.FLAG_ACTIVITY_NEW_TASK)
         notification_intent.setAction(Intent.ACTION_MAIN)
         notification_intent.addCategory(Intent.CATEGORY_LAUNCHER)
-        notification_intent = self.PendingIntent.getActivity(self.service, 0, notification_intent, 0)
-        self.notification_builder_no_action = NotificationBuilder(app_context, NOTIFICATION_CHANNEL_ID)\
-            .setContentIntent(notification_intent)\
+        self.notification_intent = self.PendingIntent.getActivity(self.service, 0, notification_intent, 0)
+        self.notification_icon = notification_icon
+        self.notification_builder_no_action = self.NotificationBuilder(app_context, self.notification_channel_id)\
+            .setContentIntent(self.notification_intent)\
             .setSmallIcon(notification_icon)
+        # Built when the first shortcut is installed: see action_notification_builder
+        self.notification_builder = None
+        self.service.setAutoRestartService(False)
+        self.service.startForeground(self.FOREGROUND_NOTIFICATION_ID, self.build_service_notification())
 
-        notification_image = join(dirname(__file__), '..', 'images', 'stop.png')
-        bm = self.BitmapFactory.decodeFile(notification_image, self.bitmap_factory_options)
-        icon = self.Icon.createWithBitmap(bm)
-        broadcastIntent = Intent(ACTION_STOP_SH)
-        actionIntent = self.PendingIntent.getBroadcast(self.service,
-                                                       0,
-                                                       broadcastIntent,
-                                                       self.PendingIntent.FLAG_UPDATE_CURRENT)
-        stop_action = NotificationActionBuilder(
-            icon,
-            self.AndroidString('STOP'.encode('utf-8')),
-            actionIntent).build()
-
-        notification_image = join(dirname(__file__), '..', 'images', 'repeat.png')
-        bm = self.BitmapFactory.decodeFile(notification_image, self.bitmap_factory_options)
-        icon = self.Icon.createWithBitmap(bm)
-        broadcastIntent = Intent(ACTION_REPEAT_SH)
+    def notification_action(self, image, label, action):
         actionIntent = self.PendingIntent.getBroadcast(self.service,
                                                        0,
-                                                       broadcastIntent,
+                                                       self.Intent(action),
                                                        self.PendingIntent.FLAG_UPDATE_CURRENT)
-        repeat_action = NotificationActionBuilder(
-            icon,
-            self.AndroidString('REPEAT'.encode('utf-8')),
+        return self.NotificationActionBuilder(
+            self.image_icon(image),
+            self.AndroidString(label.encode('utf-8')),
             actionIntent).build()
 
-        notification_image = join(dirname(__file__), '..', 'images', 'next.png')
-        bm = self.BitmapFactory.decodeFile(notification_image, self.bitmap_factory_options)
-        icon = self.Icon.createWithBitmap(bm)
-        broadcastIntent = Intent(ACTION_NEXT_SH)
-        actionIntent = self.PendingIntent.getBroadcast(self.service,
-                                                       0,
-                                                       broadcastIntent,
-                                                       self.PendingIntent.FLAG_UPDATE_CURRENT)
-        next_action = NotificationActionBuilder(
-            icon,
-            self.AndroidString('NEXT'.encode('utf-8')),
-            actionIntent).build()
-        self.notification_builder = NotificationBuilder(app_context, NOTIFICATION_CHANNEL_ID)\
-            .setContentIntent(notification_intent)\
-            .setSmallIcon(notification_icon)\
-            .addAction(stop_action)\
-            .addAction(repeat_action)\
-            .addAction(next_action)
-        self.service.setAutoRestartService(False)
-        self.service.startForeground(self.FOREGROUND_NOTIFICATION_ID, self.build_service_notification())
+    def action_notification_builder(self):
+        if not self.notification_builder:
+            app_context = self.service.getApplication().getApplicationContext()
+            self.notification_builder = self.NotificationBuilder(app_context, self.notification_channel_id)\
+                .setContentIntent(self.notification_intent)\
+                .setSmallIcon(self.notification_icon)\
+                .addAction(self.notification_action('stop.png', 'STOP', ACTION_STOP_SH))\
+                .addAction(self.notification_action('repeat.png', 'REPEAT', ACTION_REPEAT_SH))\
+                .addAction(self.notification_action('next.png', 'NEXT', ACTION_NEXT_SH))
+        return self.notification_builder
 
-    def __init__(self, port_to_bind=None, port_to_send=None):
+    def __init__(self, port_to_bind=None, port_to_send=None, spool_dir=None):
         self.port_to_bind = port_to_bind
         self.port_to_send = port_to_send
         self.osc = OSCThreadServer(encoding='utf8')
         self.osc.listen(address='127.0.0.1', port=self.port_to_bind, default=True)
-        self.osc.bind('/quit', self.on_quit)
-        self.osc.bind('/request', self.on_request)
+        # Same spool_dir as the app: the spooled messages of the app are read there
+        self.ipc = bind_osc(self.osc, self.port_to_send, dict(request=self.on_request, quit=self.on_quit),
+                            spool_dir=spool_dir)
         self.br = BroadcastReceiver(self.on_broadcast, actions=[
             ACTION_STOP_SH,
             ACTION_REPEAT_SH,
@@ -162,7 +161,7 @@ class ShortcutService(object):
             self.init_notification()
         except:  # noqa E722
             Logger.error(f"Error detected {traceback.print_exc()}")
-        Logger.debug("Init ended")
+        Logger.info(f"Service ready in {(perf_counter() - _IMPORT_STARTED) * 1000:.0f} ms")
 
     def build_service_notification(self, title=None, message=None):
         nb = self.notification_builder_no_action
@@ -172,7 +171,7 @@ class ShortcutService(object):
             message = "Installing shortcuts"
         else:
             message = f"Installing shortcut {message}"
-            nb = self.notification_builder
+            nb = self.action_notification_builder()
 
         title = self.AndroidString((title if title else 'N/A').encode('utf-8'))
         message = self.AndroidString(message.encode('utf-8'))
@@ -190,14 +189,14 @@ class ShortcutService(object):
         self.loop.run_forever()
 
     def on_quit(self, msg):
+        self.ipc.close()
         self.br.stop()
         self.loop.stop()
         self.service.stopForeground(True)
         self.service.stopSelf()
 
-    def on_request(self, msg):
-        m = json.loads(msg)
-        Logger.info(f"Request received {msg}")
+    def on_request(self, m):
+        Logger.info(f"Request received {len(m['shs'])} shortcuts for {m['sh_device']}")
         self.lock.acquire()
         wasidle = len(self.requests) == 0 and not self.current_request
         if not wasidle and time() - self.last_request > 30:
@@ -210,11 +209,7 @@ class ShortcutService(object):
 
     def send_response(self, processed):
         Logger.info(f'sh_put {processed}')
-        send_message('/sh_put',
-                     (json.dumps(processed),),
-                     '127.0.0.1',
-                     self.port_to_send,
-                     encoding='utf8')
+        self.ipc.send_message('sh_put', processed)
 
     def on_broadcast(self, context, intent):
         try:
@@ -286,6 +281,7 @@ class ShortcutService(object):
                 self.set_service_notification(self.FOREGROUND_NOTIFICATION_ID, self.build_service_notification(message=sh_id))
                 builds = self.ShortcutInfoBuilder(ctx, sh_id)
                 builds.setShortLabel(self.current_request['sh_temp'].replace('$sh$', sh['name']))
+                # sh['img'] is already scaled to the launcher icon size by the app
                 builds.setIcon(self.Icon.createWithBitmap(self.BitmapFactory.decodeFile(sh['img'], self.bitmap_factory_options)))
                 bundle = self.PersistableBundle()
                 bundle.putString(DEVICE_EXTRA, json.dumps(self.current_request['device_info']))
@@ -308,6 +304,8 @@ class ShortcutService(object):
 
 
 def main():
+    # Logging without importing Kivy: the output of the service goes to logcat
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format='[%(levelname)-7s] %(message)s')
     p4a = os.environ.get('PYTHON_SERVICE_ARGUMENT', '')
     Logger.info(f"Server: p4a = {p4a}")
     args = json.loads(p4a)
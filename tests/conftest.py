@@ -0,0 +1,5 @@
+import sys
+from os.path import abspath, dirname, join
+
+# The app runs from src/: its modules are top level there
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
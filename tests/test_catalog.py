@@ -0,0 +1,46 @@
+from devicedl.catalog import Device, DeviceCatalog, split_filters
+from devicedl.hubs import Hub
+
+
+def _devices(prefix):
+    return [Device.from_dict(dict(name=f'{prefix}tv', type='DeviceRM', dir=['sony:ON', 'sony:OFF', 'lg:ON'])),
+            Device.from_dict(dict(name=f'{prefix}lamp', type='DeviceS20', sh=['on:1', 'off:0'])),
+            Device.from_dict(dict(name='plug', type='DeviceTasmotaswitch'))]
+
+
+def _catalog(nhubs=2):
+    hubs = [Hub(f'h{k}', f'10.0.0.{k}', 10001, 10000) for k in range(1, nhubs + 1)]
+    return DeviceCatalog(hubs, [_devices('') for _ in hubs])
+
+
+def _resolved(catalog, filters):
+    return [(f, dev.hub.name, remote) for f, dev, remote in catalog.resolve(split_filters(filters))]
+
+
+def test_full_names_and_filters():
+    single, multi = _catalog(1), _catalog(2)
+    assert single.filters == ['tv/sony', 'tv/lg', 'lamp/sh', 'plug']
+    assert multi.filters[:4] == ['h1:tv/sony', 'h1:tv/lg', 'h1:lamp/sh', 'h1:plug']
+    assert len(multi) == 6
+
+
+def test_exact_filters():
+    catalog = _catalog()
+    assert _resolved(catalog, 'h2:tv/lg, h1:plug, h1:lamp') == [
+        ('h2:tv/lg', 'h2', 'lg'), ('h1:plug', 'h1', None), ('h1:lamp', 'h1', None)]
+    # Missing devices and remotes are dropped; devices without remotes take any
+    assert _resolved(catalog, 'h1:tv/samsung, h3:tv, h1:plug/x') == [('h1:plug/x', 'h1', 'x')]
+
+
+def test_glob_filters_across_hubs():
+    catalog = _catalog()
+    assert _resolved(catalog, '*:tv/*') == [
+        ('h1:tv/sony', 'h1', 'sony'), ('h1:tv/lg', 'h1', 'lg'),
+        ('h2:tv/sony', 'h2', 'sony'), ('h2:tv/lg', 'h2', 'lg')]
+    assert _resolved(catalog, 'h2:*/sh, *plug') == [
+        ('h2:lamp/sh', 'h2', 'sh'), ('h1:plug', 'h1', None), ('h2:plug', 'h2', None)]
+
+
+def test_no_duplicates_in_pattern_order():
+    catalog = _catalog()
+    assert _resolved(catalog, 'h2:tv/lg, *:tv/l?') == [('h2:tv/lg', 'h2', 'lg'), ('h1:tv/lg', 'h1', 'lg')]
@@ -0,0 +1,39 @@
+import json
+
+from devicedl import export
+
+
+def _shs(tmp_path, keys):
+    img = tmp_path / 'i.png'
+    img.write_bytes(b'png')
+    return [dict(name=k, img=str(img), link=export.shortcut_link('hub', 10000, f'@{i} emitir tv r:{k}'))
+            for i, k in enumerate(keys, 1)]
+
+
+def _names(path):
+    with open(path) as f:
+        return [sh['name'] for sh in json.load(f)['categories'][0]['shortcuts']]
+
+
+def test_id_ignores_tag(tmp_path):
+    old, new = _shs(tmp_path, ['a', 'b']), _shs(tmp_path, ['x', 'a', 'b'])
+    assert export.shortcut_id(old[0]) == export.shortcut_id(new[1])
+    assert export.shortcut_id(old[0]) != export.shortcut_id(old[1])
+
+
+def test_merge_after_key_added(tmp_path):
+    path = str(tmp_path / 'out.json')
+    assert export.export_shortcuts(path, _shs(tmp_path, ['a', 'b']), '$sh$') == 2
+    assert export.export_shortcuts(path, _shs(tmp_path, ['x', 'a', 'b']), '$sh$') == 1
+    assert _names(path) == ['a', 'b', 'x']
+
+
+def test_merge_legacy_ids(tmp_path):
+    path = str(tmp_path / 'out.json')
+    shs = _shs(tmp_path, ['a', 'b'])
+    outjson = export.load_export(path)
+    export.merge_shortcuts(outjson, export.DEFAULT_CATEGORY,
+                           [dict(id=export._legacy_id(sh), name=sh['name']) for sh in shs])
+    export.write_export(path, outjson)
+    assert export.export_shortcuts(path, shs, '$sh$') == 0
+    assert _names(path) == ['a', 'b']
@@ -0,0 +1,174 @@
+import asyncio
+import json
+
+import pytest
+
+from devicedl.hubclient import AnswerTooLong, HubConnection, HubError
+
+
+def _run(handler, client, **kwargs):
+    """
+    Run client(conn) against a hub on localhost answering with
+    handler(reader, writer).
+    """
+    async def main():
+        server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        conn = HubConnection('127.0.0.1', port, **kwargs)
+        try:
+            return await client(conn)
+        finally:
+            conn.close()
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+async def _lines(reader, n):
+    return [(await reader.readline()).decode('utf-8').rstrip('\n') for _ in range(n)]
+
+
+def test_tagged_answers_out_of_order():
+    async def hub(reader, writer):
+        (tag1, _), (tag2, _) = [line.split(' ', 1) for line in await _lines(reader, 2)]
+        writer.write(f'{tag2} second\n{tag1} first\n'.encode('utf-8'))
+        await writer.drain()
+
+    async def client(conn):
+        return await asyncio.gather(conn.request('a'), conn.request('b'))
+    assert _run(hub, client) == [b'first', b'second']
+
+
+def test_untagged_answer_goes_to_oldest_request():
+    async def hub(reader, writer):
+        await _lines(reader, 2)
+        writer.write(b'one\ntwo\n')
+        await writer.drain()
+
+    async def client(conn):
+        return await asyncio.gather(conn.request('a'), conn.request('b'))
+    assert _run(hub, client) == [b'one', b'two']
+
+
+def test_answer_split_inside_the_tag():
+    async def hub(reader, writer):
+        tag = (await _lines(reader, 1))[0].split(' ', 1)[0]
+        for part in (tag[:1], tag[1:] + ' hel', 'lo\n'):
+            writer.write(part.encode('utf-8'))
+            await writer.drain()
+            await asyncio.sleep(0.02)
+
+    async def client(conn):
+        return await conn.request('a')
+    assert _run(hub, client) == b'hello'
+
+
+def test_connection_is_reused():
+    connections = []
+
+    async def hub(reader, writer):
+        connections.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(line.split(b' ', 1)[0] + b' ok\n')
+            await writer.drain()
+
+    async def client(conn):
+        return [await conn.request('a'), await conn.request('b')]
+    assert _run(hub, client) == [b'ok', b'ok']
+    assert len(connections) == 1
+
+
+def test_read_timeout_is_silence():
+    async def hub(reader, writer):
+        tag = (await _lines(reader, 1))[0].split(' ', 1)[0]
+        writer.write(f'{tag} '.encode('utf-8'))
+        # Longer than read_timeout in all, never silent for that long
+        for _ in range(6):
+            writer.write(b'x')
+            await writer.drain()
+            await asyncio.sleep(0.05)
+        writer.write(b'\n')
+        await writer.drain()
+
+    async def client(conn):
+        return await conn.request('a')
+    assert _run(hub, client, read_timeout=0.2) == b'xxxxxx'
+
+
+def test_read_timeout():
+    async def hub(reader, writer):
+        await _lines(reader, 1)
+        await asyncio.sleep(1)
+
+    async def client(conn):
+        with pytest.raises(HubError) as info:
+            await conn.request('a')
+        return info.value.__cause__
+    assert isinstance(_run(hub, client, read_timeout=0.1, retries=1), asyncio.TimeoutError)
+
+
+def test_retry_on_new_connection():
+    connections = []
+
+    async def hub(reader, writer):
+        connections.append(writer)
+        line = await reader.readline()
+        if len(connections) == 1:
+            writer.close()
+            return
+        writer.write(line.split(b' ', 1)[0] + b' ok\n')
+        await writer.drain()
+
+    async def client(conn):
+        return await conn.request('a')
+    assert _run(hub, client, retries=2, backoff=0.01) == b'ok'
+    assert len(connections) == 2
+
+
+def _answer_with(text):
+    async def hub(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(line.split(b' ', 1)[0] + b' ' + text + b'\n')
+            await writer.drain()
+    return hub
+
+
+def test_size_cap_is_not_retried():
+    connections = []
+    hub = _answer_with(b'x' * 5000)
+
+    async def counting_hub(reader, writer):
+        connections.append(writer)
+        await hub(reader, writer)
+
+    async def client(conn):
+        with pytest.raises(AnswerTooLong):
+            await conn.request('a', max_size=1000)
+    _run(counting_hub, client, retries=3, backoff=0.01)
+    assert len(connections) == 1
+
+
+def test_download_devices():
+    doc = json.dumps({'action': {'hosts': {'tv': {'type': 'DeviceRM'}, 'lamp': {'type': 'DeviceS20'}}}})
+    got = []
+
+    async def client(conn):
+        return await conn.download_devices(lambda name, dev: got.append((name, dev['type'])))
+    assert _run(_answer_with(doc.encode('utf-8')), client) == len(doc)
+    assert got == [('tv', 'DeviceRM'), ('lamp', 'DeviceS20')]
+
+
+def test_download_error_answer_is_not_an_empty_list():
+    started = []
+
+    async def client(conn):
+        with pytest.raises(HubError, match='No object'):
+            await conn.download_devices(lambda name, dev: None, on_start=lambda: started.append(1))
+    _run(_answer_with(b'{"action": {"error": "busy"}}'), client, retries=2, backoff=0.01)
+    assert started == [1, 1]
@@ -0,0 +1,90 @@
+import os
+import time
+
+from devicedl.iconcache import MANIFEST, ORPHAN_AGE, TMP_AGE, IconCache
+
+
+def _cache(tmp_path, budget=1 << 20):
+    cache = IconCache(1, budget)
+    cache.set_path(str(tmp_path / 'generated'))
+    return cache
+
+
+def test_source_overwritten_in_place(tmp_path):
+    cache = _cache(tmp_path)
+    src = tmp_path / 'tv.png'
+    src.write_bytes(b'old icon')
+    key = cache.key(str(src), (255, 0, 0))
+    assert cache.key(str(src), (255, 0, 0)) == key
+    mtime = os.stat(tmp_path).st_mtime_ns
+    src.write_bytes(b'new icon content')
+    assert os.stat(tmp_path).st_mtime_ns == mtime
+    assert cache.key(str(src), (255, 0, 0)) != key
+
+
+def _icon(cache, key, size, used):
+    path = cache.icon(key)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    cache.add(path)
+    cache.entries[key][1] = used
+    return path
+
+
+def _age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_lru_eviction(tmp_path):
+    cache = _cache(tmp_path, budget=2500)
+    old = _icon(cache, 'old', 1000, 1)
+    kept = _icon(cache, 'kept', 1000, 2)
+    _icon(cache, 'mid', 1000, 3)
+    _icon(cache, 'new', 1000, 4)
+    assert cache.size == 4000
+    assert cache.compact(keep={kept}) == 2
+    assert sorted(cache.entries) == ['kept', 'new']
+    assert cache.size == 2000
+    assert not os.path.exists(old)
+
+
+def test_has_marks_used(tmp_path):
+    cache = _cache(tmp_path, budget=1500)
+    _icon(cache, 'a', 1000, 1)
+    _icon(cache, 'b', 1000, 2)
+    assert cache.has('a') and not cache.has('c')
+    cache.compact()
+    assert list(cache.entries) == ['a']
+
+
+def test_compact_orphans(tmp_path):
+    cache = _cache(tmp_path)
+    _icon(cache, 'known', 10, 1)
+    gen = tmp_path / 'generated'
+    for name, age in (('orphan.png', ORPHAN_AGE + 10), ('young.png', 0), ('busy.png', ORPHAN_AGE + 10),
+                      ('x.png.tmp', ORPHAN_AGE + 10), ('old.png.tmp', TMP_AGE + 10)):
+        (gen / name).write_bytes(b'x')
+        _age(str(gen / name), age)
+    # An entry whose file is gone is forgotten
+    cache.entries['gone'] = [5, 1]
+    assert cache.compact(busy={str(gen / 'busy.png')}) == 2
+    assert sorted(p.name for p in gen.iterdir()) == sorted([
+        MANIFEST, 'busy.png', 'known.png', 'x.png.tmp', 'young.png'])
+    assert list(cache.entries) == ['known']
+
+
+def test_manifest_reload(tmp_path):
+    cache = _cache(tmp_path)
+    src = tmp_path / 'tv.png'
+    src.write_bytes(b'icon')
+    key = cache.key(str(src), (0, 255, 0))
+    _icon(cache, key, 10, 1)
+    cache.save()
+    again = _cache(tmp_path)
+    assert again.has(key) and again.size == 10
+    assert again.sources == cache.sources
+    # A new renderer version drops the icons
+    other = IconCache(2)
+    other.set_path(str(tmp_path / 'generated'))
+    assert not other.entries
@@ -0,0 +1,218 @@
+import threading
+
+import pytest
+
+from devicedl import ipc
+from devicedl.ipc import IpcChannel, bind_osc, decode, encode
+
+
+@pytest.mark.parametrize('obj', [
+    None, True, False, 0, 1, -1, 63, -64, 2 ** 40, -2 ** 40, 0.5, -1e300,
+    '', 'abc', 'àè€\0', b'', b'\0\xff\x80', [], [1, [2, [3]]], (1, 2), {},
+    dict(a=1, b=[None, 'x'], c=dict(d=b'\0')),
+])
+def test_roundtrip(obj):
+    out = decode(encode(obj))
+    assert out == (list(obj) if isinstance(obj, tuple) else obj)
+    assert type(out) is (list if isinstance(obj, tuple) else type(obj))
+
+
+def test_repeated_strings_are_references():
+    rows = [dict(name=f'n{i}', host='192.168.1.1', dtype='DeviceRM') for i in range(100)]
+    data = encode(rows)
+    assert decode(data) == rows
+    assert data.count(b'192.168.1.1') == 1
+
+
+def test_bad_data():
+    with pytest.raises(ValueError):
+        decode(b'')
+    with pytest.raises(ValueError):
+        decode(b'\x00N')
+    with pytest.raises(ValueError):
+        decode(encode(1) + b'N')
+    with pytest.raises(TypeError):
+        encode(object())
+
+
+class _Peer(object):
+    def __init__(self, server_cls, handlers, spool_dir=None, drop=None):
+        self.osc = server_cls(encoding='utf8')
+        self.osc.listen(address='127.0.0.1', port=0, default=True)
+        self.port = self.osc.getaddress()[1]
+        self.drop = drop
+        self.handlers = handlers
+        self.spool_dir = spool_dir
+
+    def bind(self, port):
+        self.channel = bind_osc(self.osc, port, self.handlers, self.spool_dir)
+        if self.drop:
+            send = self.channel.send
+            self.channel.send = lambda address, args: None if self.drop(address, args) else send(address, args)
+
+    def stop(self):
+        self.channel.close()
+        self.osc.terminate_server()
+        self.osc.join_server()
+        self.osc.stop_all()
+
+
+@pytest.fixture
+def peers(tmp_path):
+    server = pytest.importorskip('oscpy.server')
+    made = []
+
+    def make(drop_a=None, drop_b=None):
+        got = []
+        done = threading.Event()
+
+        def on_request(obj):
+            got.append(obj)
+            done.set()
+        a = _Peer(server.OSCThreadServer, dict(), spool_dir=str(tmp_path), drop=drop_a)
+        b = _Peer(server.OSCThreadServer, dict(request=on_request), spool_dir=str(tmp_path), drop=drop_b)
+        a.bind(b.port)
+        b.bind(a.port)
+        made.extend((a, b))
+        return a, b, got, done
+    yield make
+    for p in made:
+        p.stop()
+
+
+def _request(n):
+    return dict(shs=[dict(name=f'key {i}', img=f'/icons/{i:040x}.png', link=f'udp://10.0.0.1:10000/%40{i}%20emitir')
+                     for i in range(n)],
+                sh_device='tv - sony - ', device_info=dict(name='tv', type='DeviceRM'))
+
+
+def test_osc_chunked(peers):
+    a, b, got, done = peers()
+    req = _request(300)
+    assert len(encode(['request', req])) > 2 * ipc.CHUNK_SIZE
+    a.channel.send_message('request', req)
+    assert done.wait(5)
+    assert got == [req]
+    # The ack reached the sender
+    for _ in range(50):
+        if not a.channel._outgoing:
+            break
+        threading.Event().wait(0.05)
+    assert not a.channel._outgoing
+
+
+def test_osc_spooled(peers, monkeypatch, tmp_path):
+    monkeypatch.setattr(ipc, 'SPOOL_MIN', 1024)
+    a, b, got, done = peers()
+    req = _request(100)
+    a.channel.send_message('request', req)
+    assert done.wait(5)
+    assert got == [req]
+    assert not list(tmp_path.iterdir())
+
+
+def test_osc_lost_ack(peers, monkeypatch):
+    monkeypatch.setattr(ipc, 'ACK_TIMEOUT', 0.2)
+    lost = []
+
+    def drop_first_ack(address, args):
+        if address == '/ipc_ack' and not lost:
+            lost.append(args)
+            return True
+        return False
+    a, b, got, done = peers(drop_b=drop_first_ack)
+    req = _request(50)
+    a.channel.send_message('request', req)
+    assert done.wait(5)
+    # The message is sent again and acknowledged, but delivered once
+    for _ in range(50):
+        if not a.channel._outgoing:
+            break
+        threading.Event().wait(0.05)
+    assert lost
+    assert not a.channel._outgoing
+    assert got == [req]
+
+
+def test_lost_chunk_is_sent_again(monkeypatch):
+    monkeypatch.setattr(ipc, 'ACK_TIMEOUT', 0.1)
+    monkeypatch.setattr(ipc, 'CHUNK_SIZE', 64)
+    got = []
+    done = threading.Event()
+    dropped = []
+
+    def send_a(address, args):
+        if address == '/ipc' and args[1] == 1 and not dropped:
+            dropped.append(args)
+            return
+        b.on_chunk(*args)
+
+    a = IpcChannel(send_a, dict())
+    b = IpcChannel(lambda address, args: a.on_ack(*args), dict(request=lambda obj: (got.append(obj), done.set())))
+    req = _request(10)
+    a.send_message('request', req)
+    assert done.wait(5)
+    assert dropped
+    assert got == [req]
+    a.close()
+
+
+def _receiver(spool_dir, got):
+    return IpcChannel(lambda address, args: None, dict(request=got.append), spool_dir)
+
+
+def test_spooled_path_outside_spool_dir(tmp_path):
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    victim = tmp_path / 'ipc_1_7.bin'
+    victim.write_bytes(encode(['request', 'x']))
+    got = []
+    _receiver(str(spool), got).on_chunk(7, 0, 0, str(victim).encode('utf-8'))
+    (spool / 'other.bin').write_bytes(encode(['request', 'x']))
+    _receiver(str(spool), got).on_chunk(8, 0, 0, str(spool / 'other.bin').encode('utf-8'))
+    _receiver(str(spool), got).on_chunk(9, 0, 0, str(spool / '..' / 'ipc_1_9.bin').encode('utf-8'))
+    assert victim.exists() and (spool / 'other.bin').exists()
+    assert got == []
+
+
+def test_spooled_without_spool_dir(tmp_path):
+    path = tmp_path / 'ipc_1_7.bin'
+    path.write_bytes(encode(['request', 'x']))
+    got = []
+    _receiver(None, got).on_chunk(7, 0, 0, str(path).encode('utf-8'))
+    assert path.exists()
+    assert got == []
+
+
+def test_spooled_file_checks(tmp_path):
+    got = []
+    receiver = _receiver(str(tmp_path), got)
+    # A missing file does not raise in the listener thread
+    receiver.on_chunk(7, 0, 0, str(tmp_path / 'ipc_1_7.bin').encode('utf-8'))
+    # The name must carry the id of the message
+    (tmp_path / 'ipc_1_8.bin').write_bytes(encode(['request', 'x']))
+    receiver.on_chunk(9, 0, 0, str(tmp_path / 'ipc_1_8.bin').encode('utf-8'))
+    assert got == []
+    receiver.on_chunk(8, 0, 0, str(tmp_path / 'ipc_1_8.bin').encode('utf-8'))
+    assert got == ['x']
+    assert not list(tmp_path.iterdir())
+
+
+def test_close_waits_for_ack(monkeypatch):
+    monkeypatch.setattr(ipc, 'ACK_TIMEOUT', 0.1)
+    got = []
+    dropped = []
+
+    def send_a(address, args):
+        if not dropped:
+            dropped.append(args)
+            return
+        b.on_chunk(*args)
+
+    a = IpcChannel(send_a, dict())
+    b = IpcChannel(lambda address, args: a.on_ack(*args), dict(quit=got.append))
+    a.send_message('quit', 1)
+    a.close(2)
+    assert dropped
+    assert got == [1]
+    assert not a._outgoing
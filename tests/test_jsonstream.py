@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from devicedl.jsonstream import MemberStreamParser
+
+HOSTS = {
+    'tv': {'name': 'tv', 'type': 'DeviceRM', 'dir': ['sony:ON', 'sony:{x}'], 'nicks': {}},
+    'lamp "kitchen"': {'name': 'lamp "kitchen"', 'type': 'DeviceS20', 'sh': ['a,b:x', 'c]:y']},
+    'empty': {},
+}
+DOC = json.dumps({'action': {'actionclass': 'ActionDevicedl', 'hosts': HOSTS, 'ip': '1.2.3.4'},
+                  'other': {'hosts': {'x': 1}}}).encode('utf-8')
+
+
+def _parse(doc, size):
+    parser = MemberStreamParser()
+    members = []
+    for k in range(0, len(doc), size):
+        members.extend(parser.feed(doc[k:k + size]))
+    return parser, members
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, len(DOC)])
+def test_members_across_chunks(size):
+    parser, members = _parse(DOC, size)
+    assert members == list(HOSTS.items())
+    assert parser.nbytes == len(DOC)
+    parser.finish()
+
+
+def test_only_member_text_is_kept():
+    parser = MemberStreamParser()
+    parser.feed(DOC[:DOC.index(b'"lamp')])
+    # The tv member is complete: only the separator after it may be left
+    assert len(parser._buf) < 4
+
+
+def test_empty_hosts():
+    parser, members = _parse(b'{"action": {"hosts": {}}}', 5)
+    assert members == []
+    parser.finish()
+
+
+def test_unicode_split_inside_a_character():
+    doc = json.dumps({'action': {'hosts': {'tv': {'name': 'tv è'}}}}, ensure_ascii=False).encode('utf-8')
+    parser, members = _parse(doc, 1)
+    assert members == [('tv', {'name': 'tv è'})]
+
+
+@pytest.mark.parametrize('doc, error', [
+    (DOC[:-1], 'Truncated'),
+    (DOC[:DOC.index(b'"lamp')], 'Truncated'),
+    (b'{"action": {"error": "busy"}}', 'No object'),
+    (b'{"action": {"hosts": []}}', 'No object'),
+])
+def test_finish_errors(doc, error):
+    parser, _ = _parse(doc, 10)
+    with pytest.raises(ValueError, match=error):
+        parser.finish()
@@ -0,0 +1,84 @@
+from devicedl.rows import NameIndex, RowStore, bit_indices
+
+
+def _row(name, group='', dname='tv', **kw):
+    return dict(dname=dname, dname2='', group=group, filter='tv', dtype='DeviceRM', host='10.0.0.1',
+                tcpport=10001, udpport=10000, name=name, msg=f'@1 emitir tv {name}', ico='/i/default.png', **kw)
+
+
+def test_select_all_visible_only():
+    store = RowStore([_row(n) for n in ('ON', 'OFF', 'vol+', 'vol-')])
+    store.set_filter(store.search('vol'))
+    store.select_all()
+    assert list(store.selected_indices()) == [2, 3]
+    store.set_filter(None)
+    store.select_all()
+    assert list(store.selected_indices()) == [0, 1, 2, 3]
+
+
+def _store():
+    rows = [_row(n) for n in ('ON', 'OFF', 'Volume up', 'Volume down', 'mute')]
+    rows += [_row(n, group='lamp', dname='lamp') for n in ('ON', 'OFF')]
+    return RowStore(rows)
+
+
+def test_bit_indices():
+    assert list(bit_indices(0)) == []
+    assert list(bit_indices(1 << 0 | 1 << 9 | 1 << 64)) == [0, 9, 64]
+
+
+def test_name_index():
+    idx = NameIndex()
+    idx.extend(['Volume up', 'Volume down', 'mute', 'tv: up'])
+    # Trigram substring match
+    assert idx.search('lum') == [0, 1]
+    assert idx.search('UME') == [0, 1]
+    # Refined query filters the previous result
+    assert idx.search('lume d') == [1]
+    # Short queries match word prefixes
+    assert idx.search('u') == [0, 3]
+    assert idx.search('mu') == [2]
+    assert idx.search('zz') == [] and idx.search('zzz') == []
+    idx.extend(['upper'])
+    assert idx.search('u') == [0, 3, 4]
+
+
+def test_sections_are_shared():
+    store = _store()
+    assert len(store) == 7
+    assert len(store.sections) == 2
+    assert store[5]['dname'] == 'lamp' and store[5]['name'] == 'ON'
+    assert store[-1]['group'] == 'lamp'
+    assert dict(store[0].items()) == dict(_row('ON'), sel=False, ico_pending='')
+
+
+def test_search_labels_and_filter():
+    store = _store()
+    found = store.search('lamp')
+    assert found == [5, 6]
+    store.set_filter(found)
+    assert len(store) == 2
+    assert [r['name'] for r in store] == ['ON', 'OFF']
+    assert store[0].index == 5
+
+
+def test_selection_bitset():
+    store = _store()
+    store.select(1)
+    store[3]['sel'] = True
+    store.select_many([5, 6])
+    assert list(store.selected_indices()) == [1, 3, 5, 6]
+    assert store[3]['sel'] and not store[0]['sel']
+    store.select(5, False)
+    assert list(store.selected_indices()) == [1, 3, 6]
+    store.select_none()
+    assert list(store.selected_indices()) == []
+    store.extend([_row('new', sel=True)])
+    assert list(store.selected_indices()) == [7]
+
+
+def test_resolve_pending():
+    store = RowStore([_row('a', ico_pending='/g/a.png'), _row('b', ico_pending='/g/b.png')])
+    assert store.resolve_pending({'/g/b.png'})
+    assert [r['ico'] for r in store] == ['/i/default.png', '/g/b.png']
+    assert not store.resolve_pending({'/g/b.png'})
@@ -0,0 +1,53 @@
+import pickle
+
+from devicedl import snapshot
+from devicedl.catalog import Device
+
+
+def _devices():
+    return [Device.from_dict(dict(name='tv', type='DeviceRM', dir=['sony:ON', 'sony:1', 'lg:ON'])),
+            Device.from_dict(dict(name='lamp', type='DeviceS20', subtype='1', nicks={'0': 'OFF', '1': 'ON'},
+                                  sh=['a:x', 'b:y']))]
+
+
+def _fields(devs):
+    return [(d.name, d.type, d.subtype, d.nicks, d.sh, d.remotes) for d in devs]
+
+
+def test_round_trip(tmp_path):
+    path = snapshot.snapshot_path(str(tmp_path), '10.0.0.1', 10001)
+    devs = _devices()
+    saved = snapshot.save_snapshot(path, devs)
+    snap = snapshot.load_snapshot(path)
+    assert _fields(snap.devices) == _fields(devs)
+    assert snap.digest == saved.digest == snapshot.snapshot_digest(devs)
+    assert snap.created == saved.created
+
+
+def test_digest_ignores_catalog_fields():
+    devs = _devices()
+    digest = snapshot.snapshot_digest(devs)
+    devs[0].hub, devs[0].fullname = object(), 'hub:tv'
+    assert snapshot.snapshot_digest(devs) == digest
+
+
+def test_pickle_is_not_loaded(tmp_path):
+    path = str(tmp_path / 'x.snap')
+    payload = pickle.dumps(_devices())
+    # Even with a valid header an old (or planted) pickle is not unpickled
+    for version in (2, snapshot.SNAPSHOT_VERSION):
+        with open(path, 'wb') as f:
+            f.write(snapshot._HEADER.pack(snapshot.SNAPSHOT_MAGIC, version, 0.0,
+                                          snapshot.hashlib.sha1(payload).digest()))
+            f.write(payload)
+        assert snapshot.load_snapshot(path) is None
+
+
+def test_missing_and_corrupted(tmp_path):
+    path = str(tmp_path / 'x.snap')
+    assert snapshot.load_snapshot(path) is None
+    snapshot.save_snapshot(path, _devices())
+    with open(path, 'r+b') as f:
+        f.seek(-1, 2)
+        f.write(b'\xff')
+    assert snapshot.load_snapshot(path) is None
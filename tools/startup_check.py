@@ -0,0 +1,118 @@
+"""
+Startup budget of the app and of its processes, checked against
+startup_budget.json:
+
+- import time of every module in "imports" (best of "repeat" fresh
+  interpreters, from python -X importtime) and the modules it must not
+  import: they are to be imported only when first needed;
+- time to interactive of the app: from its first Kivy import to the
+  first frame, as printed by main.py run with DEVICEDL_STARTUP_CHECK set.
+
+PIL is not forbidden to main: the image providers of Kivy import it when
+Pillow is installed, as it always is on the desktop.
+
+Modules whose dependencies are not installed (Kivy on a build box, the
+android package off-device) are skipped. Exit status is 1 when a budget
+is exceeded.
+
+    python tools/startup_check.py [--budget FILE] [--strict]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+SRC = join(dirname(dirname(abspath(__file__))), 'src')
+STARTUP_CHECK_ENV = 'DEVICEDL_STARTUP_CHECK'
+_IMPORTTIME_RE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$')
+_INTERACTIVE_RE = re.compile(r'^STARTUP interactive_ms=(\d+)$', re.M)
+_PROBE = 'import json, sys, {0}; print(json.dumps(sorted(sys.modules)))'
+
+
+def _run(args, env=None, timeout=120):
+    return subprocess.run([sys.executable] + args, cwd=SRC, env=env, timeout=timeout,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def _missing(stderr):
+    mo = re.search(r"ModuleNotFoundError: No module named '([^']+)'", stderr)
+    return mo.group(1) if mo else None
+
+
+def import_time(module, repeat):
+    """
+    Return (best import time in ms, modules imported) or (None, why it
+    cannot be measured here).
+    """
+    best = None
+    for _ in range(repeat):
+        res = _run(['-X', 'importtime', '-c', f'import {module}'])
+        if res.returncode:
+            missing = _missing(res.stderr)
+            return None, f'missing {missing}' if missing else res.stderr.strip().splitlines()[-1]
+        for line in res.stderr.splitlines():
+            mo = _IMPORTTIME_RE.match(line)
+            if mo and mo.group(2) == module:
+                us = int(mo.group(1))
+                best = us if best is None else min(best, us)
+    if best is None:
+        return None, 'no import time for ' + module
+    res = _run(['-c', _PROBE.format(module)])
+    return best / 1000, json.loads(res.stdout)
+
+
+def interactive_time(timeout):
+    """
+    Return (the ms to the first frame reported by main.py, None), or
+    (None, why) if the app cannot be run here.
+    """
+    env = dict(os.environ, KIVY_NO_ARGS='1', KIVY_NO_CONSOLELOG='1')
+    env[STARTUP_CHECK_ENV] = '1'
+    try:
+        res = _run(['main.py'], env=env, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None, 'timeout'
+    mo = _INTERACTIVE_RE.search(res.stdout)
+    if not mo:
+        missing = _missing(res.stderr)
+        return None, f'missing {missing}' if missing else 'no first frame'
+    return int(mo.group(1)), None
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Check the startup budget.')
+    p.add_argument('--budget', default=join(dirname(abspath(__file__)), 'startup_budget.json'))
+    p.add_argument('--strict', action='store_true', help='fail on the checks that cannot run here')
+    args = p.parse_args(argv)
+    with open(args.budget) as f:
+        budget = json.load(f)
+    failed = skipped = 0
+    for module, limits in budget['imports'].items():
+        ms, modules = import_time(module, budget.get('repeat', 5))
+        if ms is None:
+            print(f'SKIP import {module}: {modules}')
+            skipped += 1
+            continue
+        bad = sorted(m for m in limits.get('forbid', ())
+                     if any(n == m or n.startswith(m + '.') for n in modules))
+        ok = ms <= limits['ms'] and not bad
+        print(f'{"OK  " if ok else "FAIL"} import {module}: {ms:.0f} ms (budget {limits["ms"]} ms)' +
+              (f', imports {", ".join(bad)}' if bad else ''))
+        failed += not ok
+    if 'interactive_ms' in budget:
+        ms, why = interactive_time(budget['interactive_ms'] / 1000 * 10)
+        if ms is None:
+            print(f'SKIP interactive: {why}')
+            skipped += 1
+        else:
+            ok = ms <= budget['interactive_ms']
+            print(f'{"OK  " if ok else "FAIL"} interactive: {ms:.0f} ms (budget {budget["interactive_ms"]} ms)')
+            failed += not ok
+    return 1 if failed or (args.strict and skipped) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())